@@ -1,18 +1,69 @@
 # Welcome to my Flask app setup! This file is the starter for the web server.
 # Setting up the basics and connecting different parts of the project.
 
-from flask import Flask
+import json
+import os
+import click
+from flask import Flask, jsonify, request
 from flask_cors import CORS
 from .routes import main
+from .models import registry, start_idle_reaper
+from .backends import convert_models, compare_backends
+from .jobs import start_job_workers
+from .ocr import MAX_UPLOAD_BYTES
 
-def create_app():
+def create_app(start_background=True):
+    """Build the app. The gunicorn master passes start_background=False: threads don't
+    survive fork, so each worker starts its own (see server.py)."""
     app = Flask(__name__)
 
     # This lets our app talk to websites from different domains safely,
 
     CORS(app)  # Enable CORS for cross-origin requests
 
+    # Uploads bigger than OCR_MAX_UPLOAD_MB are refused before they are read
+    # (/process/batch raises the limit to OCR_MAX_BATCH_MB for its own requests)
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+    @app.errorhandler(413)
+    def too_large(e):
+        limit = request.max_content_length or MAX_UPLOAD_BYTES
+        return jsonify({'error': f"Upload is larger than {limit // 2**20} MiB"}), 413
+
     # Register the blueprint for routes
     app.register_blueprint(main)
 
+    # Models load lazily on first use. OCR_WARM_MODELS="trocr,m2m100" (or "all")
+    # loads them up front instead, so the first request doesn't have to wait.
+    warm = os.environ.get('OCR_WARM_MODELS', '').strip()
+    if warm:
+        registry.warm(None if warm == 'all' else [name.strip() for name in warm.split(',') if name.strip()])
+    if start_background:
+        start_idle_reaper()
+        # Background workers for the /jobs API (also picks up jobs left over from a restart)
+        start_job_workers()
+
+    @app.cli.command('warm-models')
+    @click.argument('names', nargs=-1)
+    def warm_models(names):
+        """Load models now and print their load time and memory use."""
+        for name, info in registry.warm(list(names) or None).items():
+            click.echo(f"{name}: loaded={info['loaded']} load_seconds={info['load_seconds']} rss_bytes={info['rss_bytes']}")
+
+    @app.cli.command('convert-models')
+    @click.option('--backend', type=click.Choice(['onnx']), default='onnx')
+    @click.argument('names', nargs=-1)
+    def convert_models_command(backend, names):
+        """Convert TrOCR/M2M100 once for a faster CPU backend (OCR_MODEL_BACKEND)."""
+        for path in convert_models(backend, list(names) or None):
+            click.echo(f"Saved {path}")
+
+    @app.cli.command('compare-backends')
+    @click.option('--backend', type=click.Choice(['int8', 'onnx']), default='int8')
+    @click.option('--report', default='backend_report.json', help='Where to write the JSON report.')
+    @click.argument('names', nargs=-1)
+    def compare_backends_command(backend, report, names):
+        """Compare accuracy and latency of a backend against fp32."""
+        click.echo(json.dumps(compare_backends(backend, list(names) or None, report), indent=2, ensure_ascii=False))
+
     return app
\ No newline at end of file
@@ -0,0 +1,222 @@
+'''
+This file decides how the torch models (TrOCR, M2M100) actually run on the CPU.
+
+- fp32: the original eager PyTorch model (default).
+- int8: the same model with its Linear layers dynamically quantized to int8.
+  Smaller and usually a good deal faster on CPU. Quantized when the model is loaded,
+  there is nothing to convert: the quantized module can only be rebuilt from the fp32 one.
+- onnx: the model exported to ONNX and run by ONNX Runtime (needs `optimum[onnxruntime]`).
+
+ONNX models are exported once to OCR_CONVERTED_MODELS_DIR and loaded from there
+automatically afterwards. compare_backends() measures accuracy and latency of a
+backend against fp32 so we know what the speedup costs.
+'''
+
+import gc
+import json
+import logging
+import os
+import time
+
+from .models import current_rss
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('fp32', 'int8', 'onnx')
+MODEL_BACKEND = os.environ.get('OCR_MODEL_BACKEND', 'fp32')
+CONVERTED_DIR = os.environ.get(
+    'OCR_CONVERTED_MODELS_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'converted_models')
+)
+
+# A few printed lines we can render and read back, used for the comparison report
+SAMPLE_TEXTS = [
+    "Invoice number 4821, due on 12 March 2025.",
+    "The quick brown fox jumps over the lazy dog.",
+    "Total amount payable: 1,250.00 EUR",
+    "Please sign and return the attached form.",
+    "Meeting moved to Thursday at 3:30 PM.",
+    "All rights reserved. Printed in Germany.",
+]
+
+_specs = {}
+
+
+def register_backend_model(key, hf_name, load_fp32, ort_class, run_samples, has_reference=False):
+    """Describe a model that can run on any backend.
+
+    load_fp32() returns the eager fp32 model, ort_class is the optimum.onnxruntime class
+    used for ONNX export, and run_samples(model, texts) runs the model on SAMPLE_TEXTS for
+    the comparison report. has_reference means the outputs should read back the texts
+    themselves (OCR), so we can also report the error against the ground truth.
+    """
+    _specs[key] = {
+        'hf_name': hf_name,
+        'load_fp32': load_fp32,
+        'ort_class': ort_class,
+        'run_samples': run_samples,
+        'has_reference': has_reference,
+    }
+
+
+def model_dir(key, backend):
+    return os.path.join(CONVERTED_DIR, key, backend)
+
+
+def _ort_class(name):
+    try:
+        from optimum import onnxruntime
+    except ImportError:
+        raise ImportError("The onnx backend needs optimum with ONNX Runtime: pip install optimum[onnxruntime]")
+    return getattr(onnxruntime, name)
+
+
+def _quantize(model):
+    """Dynamic int8 quantization of every Linear layer (in place, no second copy)."""
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def convert_model(key, backend):
+    """Convert a model once and save it under model_dir(key, backend)."""
+    spec = _specs[key]
+    if backend != 'onnx':
+        raise ValueError(f"Nothing to convert for backend '{backend}'")
+    path = model_dir(key, backend)
+    os.makedirs(path, exist_ok=True)
+    start = time.perf_counter()
+    model = _ort_class(spec['ort_class']).from_pretrained(spec['hf_name'], export=True)
+    model.save_pretrained(path)
+
+    logger.info(f"Converted {key} to {backend} in {time.perf_counter() - start:.1f}s -> {path}")
+    return model
+
+
+def load_backend_model(key, backend=None):
+    """Load a model on the configured backend, converting it first if needed."""
+    backend = backend or MODEL_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend '{backend}', expected one of {BACKENDS}")
+
+    spec = _specs[key]
+    if backend == 'fp32':
+        return spec['load_fp32']()
+    if backend == 'int8':
+        # Quantized on every load: saved int8 weights would need this same fp32 model
+        # (and the same quantization) to be loaded into, so saving them gains nothing
+        return _quantize(spec['load_fp32']()).eval()
+
+    path = model_dir(key, backend)
+    try:
+        if os.path.exists(os.path.join(path, 'config.json')):
+            return _ort_class(spec['ort_class']).from_pretrained(path)
+    except ImportError:
+        raise
+    except Exception as e:
+        # e.g. written by another torch/transformers version, or a half-written file
+        logger.error(f"Loading the {backend} version of {key} from {path} failed: {str(e)}, converting it again")
+        return convert_model(key, backend)
+
+    logger.warning(f"No {backend} version of {key} found in {path}, converting it now (one time only)")
+    return convert_model(key, backend)
+
+
+def convert_models(backend, names=None):
+    """One-time conversion command: convert the given models (or all of them)."""
+    converted = []
+    for key in names or list(_specs):
+        model = convert_model(key, backend)
+        del model
+        gc.collect()
+        converted.append(model_dir(key, backend))
+    return converted
+
+
+def character_error_rate(reference, hypothesis):
+    """Edit distance between the two strings divided by the reference length."""
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_char in enumerate(reference, start=1):
+        current = [i]
+        for j, hyp_char in enumerate(hypothesis, start=1):
+            current.append(min(
+                previous[j] + 1,  # deletion
+                current[j - 1] + 1,  # insertion
+                previous[j - 1] + (ref_char != hyp_char),  # substitution
+            ))
+        previous = current
+    return previous[-1] / len(reference)
+
+
+def _mean(values):
+    return round(sum(values) / len(values), 4) if values else 0.0
+
+
+def _measure(key, backend, texts):
+    """Load one backend, run the samples once to warm up, then time a second run."""
+    spec = _specs[key]
+    rss_before = current_rss()
+    start = time.perf_counter()
+    model = load_backend_model(key, backend)
+    load_seconds = time.perf_counter() - start
+    rss_bytes = max(current_rss() - rss_before, 0)
+
+    spec['run_samples'](model, texts[:1])
+    start = time.perf_counter()
+    outputs = spec['run_samples'](model, texts)
+    seconds = time.perf_counter() - start
+
+    del model
+    gc.collect()
+    return outputs, {
+        'load_seconds': round(load_seconds, 3),
+        'rss_bytes': rss_bytes,
+        'seconds': round(seconds, 4),
+        'seconds_per_sample': round(seconds / len(texts), 4),
+    }
+
+
+def compare_backends(backend, names=None, report_path=None, texts=None):
+    """Accuracy/latency report of a backend against the fp32 baseline."""
+    texts = texts or SAMPLE_TEXTS
+    report = {'backend': backend, 'samples': len(texts), 'models': {}}
+
+    for key in names or list(_specs):
+        baseline_outputs, baseline = _measure(key, 'fp32', texts)
+        outputs, candidate = _measure(key, backend, texts)
+
+        candidate['cer_vs_fp32'] = _mean([character_error_rate(b, o) for b, o in zip(baseline_outputs, outputs)])
+        candidate['exact_match_vs_fp32'] = _mean([float(b == o) for b, o in zip(baseline_outputs, outputs)])
+        if _specs[key]['has_reference']:
+            baseline['cer'] = _mean([character_error_rate(t, o) for t, o in zip(texts, baseline_outputs)])
+            candidate['cer'] = _mean([character_error_rate(t, o) for t, o in zip(texts, outputs)])
+
+        report['models'][key] = {
+            'fp32': baseline,
+            backend: candidate,
+            'speedup': round(baseline['seconds'] / candidate['seconds'], 2) if candidate['seconds'] else None,
+            'examples': [
+                {'fp32': b, backend: o} for b, o in list(zip(baseline_outputs, outputs))[:3]
+            ],
+        }
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"Backend comparison report written to {report_path}")
+    return report
+
+
+def render_text_line(text, height=48):
+    """Render one line of black text on white, like a cropped line from a printed page."""
+    from PIL import Image, ImageDraw, ImageFont
+    try:
+        font = ImageFont.load_default(size=height * 2 // 3)
+    except TypeError:  # Pillow < 10.1 has a single fixed-size default font
+        font = ImageFont.load_default()
+    left, top, right, bottom = font.getbbox(text)
+    image = Image.new('RGB', (right - left + 20, max(bottom - top + 20, height)), 'white')
+    ImageDraw.Draw(image).text((10 - left, 10 - top), text, fill='black', font=font)
+    return image
@@ -0,0 +1,216 @@
+'''
+This file handles many files in one request: several uploaded files, or a ZIP/TAR
+archive full of scans. Archive members are read straight from the upload stream
+(nothing is extracted to disk) and their pages are processed in parallel, all sharing
+the models and caches that are already loaded.
+'''
+
+import contextvars
+import logging
+import mimetypes
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .ocr import open_pages, ocr_source, page_result, ocr_language, MAX_UPLOAD_BYTES
+from .translate import translate_text
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pages processed at the same time, across all the files of a batch
+BATCH_WORKERS = int(os.environ.get('OCR_BATCH_WORKERS', str(os.cpu_count() or 1)))
+# Decoded pages (in MiB of pixels) rendered ahead of the workers at most
+BATCH_MAX_INFLIGHT_BYTES = int(float(os.environ.get('OCR_BATCH_MAX_INFLIGHT_MB', '256')) * 2**20)
+# Most files accepted in one batch
+MAX_BATCH_FILES = int(os.environ.get('OCR_MAX_BATCH_FILES', '1000'))
+# Largest whole batch request (each file or archive member still has OCR_MAX_UPLOAD_MB)
+MAX_BATCH_BYTES = int(float(os.environ.get('OCR_MAX_BATCH_MB', '2048')) * 2**20)
+
+ZIP_TYPES = ('application/zip', 'application/x-zip-compressed')
+TAR_TYPES = ('application/x-tar', 'application/gzip', 'application/x-gzip', 'application/x-bzip2', 'application/x-xz')
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def archive_type(file):
+    """'zip', 'tar' or None for an uploaded file."""
+    name = (file.filename or '').lower()
+    if file.mimetype in ZIP_TYPES or name.endswith('.zip'):
+        return 'zip'
+    if file.mimetype in TAR_TYPES or name.endswith(TAR_EXTENSIONS):
+        return 'tar'
+    return None
+
+
+def _skip_member(name):
+    # Folders and OS junk that ends up in archives (__MACOSX/, .DS_Store, ...)
+    base = os.path.basename(name)
+    return not base or base.startswith('.') or name.startswith('__MACOSX/')
+
+
+def iter_archive_members(file):
+    """Yield (name, mimetype, content) for each file inside a ZIP or TAR upload."""
+    if archive_type(file) == 'zip':
+        with zipfile.ZipFile(file.stream) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _skip_member(info.filename):
+                    continue
+                # Oversized members are reported without ever being read
+                content = archive.read(info) if info.file_size <= MAX_UPLOAD_BYTES else None
+                yield info.filename, mimetypes.guess_type(info.filename)[0], content
+    else:
+        # 'r|*' reads the tar as a stream, one member after another, any compression
+        with tarfile.open(fileobj=file.stream, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile() or _skip_member(member.name):
+                    continue
+                content = archive.extractfile(member).read() if member.size <= MAX_UPLOAD_BYTES else None
+                yield member.name, mimetypes.guess_type(member.name)[0], content
+
+
+def _stream_size(stream):
+    # Uploads are spooled by werkzeug, so the stream can be measured without reading it
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def iter_upload_members(files):
+    """Yield (name, mimetype, content) for every uploaded file, opening archives."""
+    for file in files:
+        if archive_type(file):
+            yield from iter_archive_members(file)
+        else:
+            # Read by open_pages, no bytes copy. Too big is reported like an archive member.
+            yield file.filename, file.mimetype, file.stream if _stream_size(file.stream) <= MAX_UPLOAD_BYTES else None
+
+
+class ByteBudget:
+    """Blocks acquire() while more than max_bytes are in flight. When nothing is in flight
+    one item always gets through, so a page bigger than the whole budget still runs."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        with self._condition:
+            while self.used and self.used + size > self.max_bytes:
+                self._condition.wait()
+            self.used += size
+
+    def release(self, size):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+def source_bytes(source):
+    """Memory a page source holds until it is OCR'd: the decoded pixels, or the text."""
+    if isinstance(source, str):
+        return len(source)
+    return source.width * source.height * len(source.getbands())
+
+
+class BatchFile:
+    """One file of a batch while its pages are spread over the pool. Whichever thread
+    finishes the last page joins the text (and translates it)."""
+
+    def __init__(self, name, params):
+        self.entry = {'filename': name}
+        self.params = params
+        self.start = time.perf_counter()
+        self.page_count = 0
+        self.pages = []
+        self.error = None
+        # The thread submitting the pages holds one until it has submitted them all
+        self._pending = 1
+        self._lock = threading.Lock()
+
+    def add_page(self):
+        with self._lock:
+            self._pending += 1
+
+    def page_done(self, page=None, error=None):
+        with self._lock:
+            if page is not None:
+                self.pages.append(page)
+            if error is not None and self.error is None:
+                self.error = error
+            self._pending -= 1
+            last = self._pending == 0
+        if last:
+            self.finish()
+
+    def finish(self):
+        params = self.params
+        try:
+            if self.error is not None:
+                raise self.error
+            pages = sorted(self.pages, key=lambda page: page['page'])
+            results = [result for result in map(page_result, pages) if result is not None]
+            text = '\n'.join(results) if results else "No text extracted"
+            if params.get('option', 'ocr') == 'translate':
+                text = translate_text(text, None, params.get('source_lang', 'auto'), params.get('target_lang', 'en'), params.get('profile'))
+            self.entry['result'] = text
+            self.entry['page_count'] = self.page_count
+            if params.get('details'):
+                self.entry['pages'] = pages
+        except Exception as e:
+            logger.error(f"Batch file {self.entry['filename']} failed: {str(e)}")
+            self.entry['error'] = str(e)
+        self.entry['seconds'] = round(time.perf_counter() - self.start, 3)
+
+
+def process_batch(members, params, workers=BATCH_WORKERS, max_inflight_bytes=None):
+    """Process (name, mimetype, content) members in parallel, results in input order.
+
+    The unit of work is a page, not a file, so one long PDF keeps every worker busy just
+    like a folder of scans does. Members are opened one at a time, and pages are only
+    rendered ahead while the decoded pages waiting for OCR stay under
+    OCR_BATCH_MAX_INFLIGHT_MB, so a big archive is never held in memory all at once.
+    """
+    budget = ByteBudget(BATCH_MAX_INFLIGHT_BYTES if max_inflight_bytes is None else max_inflight_bytes)
+    lang = ocr_language(params.get('option', 'ocr'), params.get('source_lang', 'auto'), params.get('target_lang', 'en'))
+    files = []
+
+    def run(batch_file, number, source, size):
+        try:
+            page = ocr_source(number, source, batch_file.page_count, lang, params.get('mode'))
+        except Exception as e:
+            batch_file.page_done(error=e)
+        else:
+            batch_file.page_done(page)
+        finally:
+            budget.release(size)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='batch') as pool:
+        for count, (name, mimetype, content) in enumerate(members, start=1):
+            if count > MAX_BATCH_FILES:
+                logger.warning(f"Batch has more than {MAX_BATCH_FILES} files, ignoring the rest")
+                break
+            batch_file = BatchFile(name, params)
+            files.append(batch_file)
+            try:
+                if content is None:
+                    raise ValueError(f"File is larger than {MAX_UPLOAD_BYTES // 2**20} MiB")
+                batch_file.page_count, sources = open_pages(content, mimetype, params.get('dpi'))
+                for number, source in sources:
+                    if batch_file.error is not None:
+                        break  # A page already failed, the file is reported as failed anyway
+                    size = source_bytes(source)
+                    budget.acquire(size)
+                    batch_file.add_page()
+                    # Copy the context so the page's stages end up in the request's trace
+                    pool.submit(contextvars.copy_context().run, run, batch_file, number, source, size)
+            except Exception as e:
+                batch_file.page_done(error=e)
+            else:
+                batch_file.page_done()
+    # Leaving the with block waited for every page, so every file is finished
+    return [batch_file.entry for batch_file in files]
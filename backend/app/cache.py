@@ -0,0 +1,265 @@
+'''
+This file remembers OCR results so the same page is never processed twice.
+Pages are looked up by a hash of their pixels plus the language and engine settings,
+first in a small in-memory LRU and then (optionally) in a folder on disk that
+survives restarts.
+
+It also holds the translation memory: headers, footers and UI strings come up again
+and again, so translated segments are remembered the same way (with SQLite on disk).
+'''
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from .metrics import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of pages kept in memory (0 turns the cache off)
+CACHE_SIZE = int(os.environ.get('OCR_CACHE_SIZE', '512'))
+# Folder for the on-disk tier (empty = memory only)
+CACHE_DIR = os.environ.get('OCR_CACHE_DIR', '')
+# Translated segments kept in memory (0 turns the translation memory off)
+TRANSLATION_MEMORY_SIZE = int(os.environ.get('TRANSLATE_MEMORY_SIZE', '10000'))
+# SQLite file that keeps the translation memory across restarts (empty = memory only)
+TRANSLATION_MEMORY_DB = os.environ.get('TRANSLATE_MEMORY_DB', '')
+
+
+class LRUCache:
+    """A thread-safe dict that forgets the least recently used entry when full."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResultCache:
+    """Two-tier cache (memory LRU + optional JSON files on disk) with hit/miss counters."""
+
+    def __init__(self, max_entries=CACHE_SIZE, directory=CACHE_DIR):
+        self.memory = LRUCache(max_entries)
+        self.directory = directory
+        self.enabled = max_entries > 0 or bool(directory)
+        self._counts = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        if not self.enabled:
+            return None
+
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+
+        if self.directory:
+            try:
+                with open(self._path(key), encoding='utf-8') as f:
+                    value = json.load(f)
+                self.memory.put(key, value)
+                self._count('disk_hits')
+                return value
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Reading cache entry failed: {str(e)}")
+
+        self._count('misses')
+        return None
+
+    def put(self, key, value):
+        """Store a JSON-serializable value in memory and, if configured, on disk."""
+        if not self.enabled:
+            return
+        self.memory.put(key, value)
+        self._count('stores')
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write to a temp file first so readers never see half an entry
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logger.warning(f"Writing cache entry failed: {str(e)}")
+
+    def clear(self):
+        """Forget everything kept in memory (the disk tier is left alone)."""
+        self.memory.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        stats['memory_max_entries'] = self.memory.max_entries
+        stats['disk_dir'] = self.directory or None
+        return stats
+
+
+def image_key(image, *parts):
+    """Hash of an image's pixels together with whatever settings affect the result."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}|{image.size}|".encode())
+    digest.update(image.tobytes())
+    digest.update('|'.join(str(part) for part in parts).encode())
+    return digest.hexdigest()
+
+
+def normalize_segment(segment):
+    """Segments that only differ in whitespace share one translation."""
+    return re.sub(r'\s+', ' ', segment).strip()
+
+
+class TranslationMemory:
+    """Remembers translated segments by (source lang, target lang, segment, decoding profile)."""
+
+    def __init__(self, max_entries=TRANSLATION_MEMORY_SIZE, db_path=TRANSLATION_MEMORY_DB):
+        self.memory = LRUCache(max_entries)
+        self.db_path = db_path
+        self.enabled = max_entries > 0 or bool(db_path)
+        self._counts = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0}
+        self._lock = threading.Lock()
+        # SQLite connections by process id (None when opening failed). A connection must
+        # not be used across fork, and with gunicorn's preload the master imports this
+        # module, so every worker opens its own on first use. The master's connection is
+        # kept, but never touched, in the workers: closing it there could drop its file locks.
+        self._connections = {}
+
+    def _connection(self):
+        """This process's database connection, opened on first use. Call with the lock held."""
+        if not self.db_path:
+            return None
+        pid = os.getpid()
+        if pid not in self._connections:
+            db = None
+            try:
+                db = sqlite3.connect(self.db_path, check_same_thread=False)
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS translation_memory ('
+                    'src TEXT, tgt TEXT, profile TEXT, segment TEXT, translation TEXT, '
+                    'PRIMARY KEY (src, tgt, profile, segment))'
+                )
+                db.commit()
+            except Exception as e:
+                logger.error(f"Opening translation memory {self.db_path} failed: {str(e)}")
+                db = None
+            self._connections[pid] = db
+        return self._connections[pid]
+
+    def lookup(self, src_lang, tgt_lang, profile, segments):
+        """Return the remembered translation of every segment (None where we have none)."""
+        if not self.enabled:
+            return [None] * len(segments)
+
+        results = []
+        for segment in segments:
+            key = (src_lang, tgt_lang, profile, normalize_segment(segment))
+            translation = self.memory.get(key)
+            counter = 'memory_hits'
+            if translation is None and self.db_path:
+                with self._lock:
+                    db = self._connection()
+                    row = db.execute(
+                        'SELECT translation FROM translation_memory WHERE src=? AND tgt=? AND profile=? AND segment=?',
+                        key
+                    ).fetchone() if db is not None else None
+                if row:
+                    translation = row[0]
+                    self.memory.put(key, translation)
+                    counter = 'db_hits'
+            with self._lock:
+                self._counts[counter if translation is not None else 'misses'] += 1
+            results.append(translation)
+        return results
+
+    def store(self, src_lang, tgt_lang, profile, pairs):
+        """Remember (segment, translation) pairs."""
+        if not self.enabled:
+            return
+        rows = []
+        for segment, translation in pairs:
+            key = (src_lang, tgt_lang, profile, normalize_segment(segment))
+            self.memory.put(key, translation)
+            rows.append(key + (translation,))
+        with self._lock:
+            self._counts['stores'] += len(rows)
+            db = self._connection() if rows else None
+            if db is not None:
+                try:
+                    db.executemany('INSERT OR REPLACE INTO translation_memory VALUES (?, ?, ?, ?, ?)', rows)
+                    db.commit()
+                except Exception as e:
+                    logger.warning(f"Writing translation memory failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            db = self._connection()
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['db_hits']) / lookups, 4) if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        stats['memory_max_entries'] = self.memory.max_entries
+        stats['db_path'] = self.db_path if db is not None else None
+        return stats
+
+
+ocr_cache = ResultCache()
+translation_memory = TranslationMemory()
+
+
+def _cache_metrics():
+    """Hit/miss counters of both caches for /metrics."""
+    for name, cache in (('ocr', ocr_cache), ('translation', translation_memory)):
+        stats = cache.stats()
+        for result in ('memory_hits', 'disk_hits', 'db_hits', 'misses'):
+            if result in stats:
+                yield 'ocr_cache_lookups_total', 'counter', 'Cache lookups by cache and result.', {'cache': name, 'result': result}, stats[result]
+        yield 'ocr_cache_entries', 'gauge', 'Entries kept in memory.', {'cache': name}, stats['memory_entries']
+
+
+metrics.add_collector(_cache_metrics)
@@ -0,0 +1,195 @@
+'''
+This file runs the OCR engines for a page side by side instead of one after another,
+so a page takes about as long as the slowest engine rather than the sum of all of them.
+
+- Tesseract spends its time in a subprocess, so it gets a small shared thread pool.
+- The torch engines (EasyOCR, TrOCR) each get one dedicated worker thread that uses the
+  model already loaded in this process, without a second copy of the weights. Their
+  model calls take turns on the torch threads (see torch_turn), next to Tesseract.
+- 'batched' engines (TrOCR) hand their model calls to a BatchScheduler, which already
+  runs the model on a single thread. They get several workers so pages from
+  different requests can reach the scheduler at the same time and share a batch.
+'''
+
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from .metrics import metrics, stage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set OCR_PARALLEL_ENGINES=0 to go back to running the engines one by one
+PARALLEL_ENGINES = os.environ.get('OCR_PARALLEL_ENGINES', '1') != '0'
+# Seconds an engine gets for one page before we stop waiting for it
+# (override per engine with e.g. OCR_TROCR_TIMEOUT)
+ENGINE_TIMEOUT = float(os.environ.get('OCR_ENGINE_TIMEOUT', '120'))
+# Seconds a page may wait for a free engine thread (behind other requests' pages) before
+# we give up on that engine. Waiting doesn't count against OCR_ENGINE_TIMEOUT.
+ENGINE_QUEUE_TIMEOUT = float(os.environ.get('OCR_ENGINE_QUEUE_TIMEOUT', '600'))
+# Upper bound on CPU threads used by all engines together: Tesseract gets
+# OCR_SUBPROCESS_WORKERS of them and torch the rest (at least one each)
+MAX_CPU_THREADS = int(os.environ.get('OCR_MAX_CPU_THREADS', str(os.cpu_count() or 1)))
+# Parallel Tesseract subprocesses (shared by all requests)
+SUBPROCESS_WORKERS = max(1, min(int(os.environ.get('OCR_SUBPROCESS_WORKERS', '2')), MAX_CPU_THREADS - 1))
+# torch intra-op threads for the whole process (0 = all that Tesseract leaves, can only lower it)
+TORCH_THREADS = int(os.environ.get('OCR_TORCH_THREADS', '0'))
+# Pages that can wait on a batched engine's scheduler at the same time
+BATCHED_WORKERS = int(os.environ.get('OCR_BATCHED_WORKERS', '4'))
+
+_engines = {}
+_pools = {}
+_pools_lock = threading.Lock()
+_torch_configured = False
+
+# Every thread that calls into torch starts its own set of torch.get_num_threads() threads,
+# so two models computing at once would use twice the torch share. EasyOCR and the batch
+# schedulers (TrOCR, M2M100) hold this while their model runs.
+torch_turn = threading.Lock()
+
+
+def register_engine(name, fn, kind='subprocess'):
+    """Make an engine available to run_engines. kind is 'subprocess', 'torch' or 'batched'."""
+    _engines[name] = (fn, kind)
+
+
+def engine_timeout(name):
+    return float(os.environ.get(f'OCR_{name.upper()}_TIMEOUT', ENGINE_TIMEOUT))
+
+
+def torch_threads():
+    """What the CPU budget leaves for torch after the Tesseract processes."""
+    share = max(1, MAX_CPU_THREADS - SUBPROCESS_WORKERS)
+    return min(TORCH_THREADS, share) if TORCH_THREADS > 0 else share
+
+
+def _limit_torch_threads():
+    """Give torch its share of the process's CPU budget.
+
+    torch.set_num_threads is one setting per process, shared by EasyOCR, TrOCR and
+    M2M100. They take turns (torch_turn) instead of splitting it, so a model running
+    alone still gets the whole share.
+    """
+    global _torch_configured
+    if _torch_configured:
+        return
+    _torch_configured = True
+    threads = torch_threads()
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        logger.info(f"torch intra-op threads: {threads}")
+    except ImportError:
+        pass
+
+
+def set_cpu_budget(threads):
+    """Limit this process to `threads` CPU threads, e.g. cores / workers in each gunicorn
+    worker. Must run before the first page is processed, since the pools size themselves once."""
+    global MAX_CPU_THREADS, SUBPROCESS_WORKERS, _torch_configured
+    MAX_CPU_THREADS = max(1, threads)
+    SUBPROCESS_WORKERS = max(1, min(SUBPROCESS_WORKERS, MAX_CPU_THREADS - 1))
+    _torch_configured = False
+    # torch's thread pool is per process, so set it now for M2M100 too (not just the engine pools)
+    _limit_torch_threads()
+
+
+def _pool(name):
+    _, kind = _engines[name]
+    key = 'subprocess' if kind == 'subprocess' else name
+    with _pools_lock:
+        if key not in _pools:
+            if kind == 'torch':
+                _limit_torch_threads()
+                workers = 1
+            elif kind == 'batched':
+                _limit_torch_threads()
+                workers = BATCHED_WORKERS
+            else:
+                workers = SUBPROCESS_WORKERS
+            _pools[key] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'ocr-{key}')
+        return _pools[key]
+
+
+def _run_engine(name, started, *args, **kwargs):
+    """One engine call, timed as its own stage. started gets the moment the engine began."""
+    fn, kind = _engines[name]
+    # Waiting for the torch threads counts as queueing, not against the engine timeout
+    with torch_turn if kind == 'torch' else contextlib.nullcontext():
+        started['at'] = time.monotonic()
+        started['event'].set()
+        with stage('engine', engine=name):
+            result = fn(*args, **kwargs)
+    count_engine_call(name, result)
+    return result
+
+
+def count_engine_call(name, result):
+    """Count an engine run in ocr_engine_calls_total by whether it found any text. Engines
+    run outside run_engines (cascade tier 1, code pages) call this themselves."""
+    metrics.inc('ocr_engine_calls_total', engine=name, outcome='text' if result else 'empty')
+
+
+def _started():
+    return {'event': threading.Event(), 'at': None}
+
+
+def run_engines_detailed(names, *args, **kwargs):
+    """Run the named engines on the same input. Returns their results in the same order,
+    plus {engine: 'timeout' | 'error'} for the engines that contributed nothing because
+    they failed, so the caller can report it for the page.
+
+    An engine that fails or runs out of time contributes an empty string, exactly like
+    an engine that found no text, so merging the results works the same as before.
+    """
+    problems = {}
+    if not PARALLEL_ENGINES:
+        results = []
+        for name in names:
+            try:
+                results.append(_run_engine(name, _started(), *args, **kwargs))
+            except Exception as e:
+                logger.warning(f"OCR method {name} failed: {str(e)}")
+                metrics.inc('ocr_engine_calls_total', engine=name, outcome='error')
+                problems[name] = 'error'
+                results.append("")
+        return results, problems
+
+    # Each engine runs in a copy of our context, so its stages land in this request's trace
+    futures = []
+    for name in names:
+        started = _started()
+        futures.append((name, started, _pool(name).submit(
+            contextvars.copy_context().run, _run_engine, name, started, *args, **kwargs)))
+
+    results = []
+    for name, started, future in futures:
+        try:
+            # The timeout starts when the engine does: under load a page can sit in the
+            # queue behind other requests' pages, and that must not drop the engine
+            if not started['event'].wait(ENGINE_QUEUE_TIMEOUT):
+                raise FutureTimeout()
+            remaining = engine_timeout(name) - (time.monotonic() - started['at'])
+            results.append(future.result(timeout=max(remaining, 0)))
+        except FutureTimeout:
+            # A running thread can't be killed, we just stop waiting for it
+            future.cancel()
+            logger.warning(f"OCR method {name} timed out after {engine_timeout(name)}s")
+            metrics.inc('ocr_engine_calls_total', engine=name, outcome='timeout')
+            problems[name] = 'timeout'
+            results.append("")
+        except Exception as e:
+            logger.warning(f"OCR method {name} failed: {str(e)}")
+            metrics.inc('ocr_engine_calls_total', engine=name, outcome='error')
+            problems[name] = 'error'
+            results.append("")
+    return results, problems
+
+
+def run_engines(names, *args, **kwargs):
+    """run_engines_detailed without the failure report."""
+    return run_engines_detailed(names, *args, **kwargs)[0]
@@ -0,0 +1,411 @@
+'''
+This file runs long documents in the background instead of inside the HTTP request.
+A client submits a job, gets a job id straight away and polls for progress and the
+result. Jobs live in a small SQLite database and their uploads are kept on disk, so
+nothing is lost when the server restarts: unfinished jobs are simply picked up again.
+'''
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from .ocr import open_pages, iter_ocr_pages, page_result, ocr_language
+from .translate import translate_text
+from .metrics import tracing
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = os.environ.get(
+    'OCR_JOBS_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'jobs')
+)
+# Jobs processed at the same time, and jobs allowed to wait before we push back
+JOB_WORKERS = int(os.environ.get('OCR_JOB_WORKERS', '2'))
+JOB_QUEUE_SIZE = int(os.environ.get('OCR_JOB_QUEUE_SIZE', '32'))
+# Finished jobs (and their results) are deleted this many hours after they finished (0 = keep forever)
+JOB_RETENTION_HOURS = float(os.environ.get('OCR_JOB_RETENTION_HOURS', '24'))
+# A running job whose process hasn't checked in for this many seconds (e.g. a worker that
+# was killed) is started over by another worker (0 = never). Running jobs check in 4 times as often.
+JOB_STALE_SECONDS = float(os.environ.get('OCR_JOB_STALE_SECONDS', '120'))
+
+FINISHED = ('done', 'failed', 'cancelled')
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is full and the client should retry later."""
+
+
+class JobStore:
+    """Job records in SQLite, one short-lived connection per call so any thread can use it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._ready = False
+
+    def _connect(self):
+        # The database (and its folder) is only created once the job API is actually used
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with sqlite3.connect(self.path, timeout=30) as db:
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS jobs ('
+                    'id TEXT PRIMARY KEY, status TEXT, params TEXT, filename TEXT, mimetype TEXT, '
+                    'file_path TEXT, page_count INTEGER, pages_done INTEGER DEFAULT 0, '
+                    'cancel_requested INTEGER DEFAULT 0, result TEXT, error TEXT, '
+                    'created_at REAL, started_at REAL, finished_at REAL, heartbeat_at REAL)'
+                )
+                # Databases created before heartbeats existed
+                columns = [row[1] for row in db.execute('PRAGMA table_info(jobs)')]
+                if 'heartbeat_at' not in columns:
+                    db.execute('ALTER TABLE jobs ADD COLUMN heartbeat_at REAL')
+            self._ready = True
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def create(self, job_id, params, filename=None, mimetype=None, file_path=None):
+        with self._connect() as db:
+            db.execute(
+                'INSERT INTO jobs (id, status, params, filename, mimetype, file_path, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, 'queued', json.dumps(params), filename, mimetype, file_path, time.time())
+            )
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'] or '{}')
+        return job
+
+    def update(self, job_id, **fields):
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self._connect() as db:
+            db.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+
+    def delete(self, job_id):
+        with self._connect() as db:
+            db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def cancel_queued(self, job_id):
+        """Cancel a job if it hasn't started yet. Returns False when someone claimed it first."""
+        with self._connect() as db:
+            cancelled = db.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            ).rowcount
+        return cancelled == 1
+
+    def expired(self, finished_before):
+        """(id, upload path) of the jobs that finished before the given time."""
+        with self._connect() as db:
+            rows = db.execute(
+                'SELECT id, file_path FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?',
+                FINISHED + (finished_before,)
+            ).fetchall()
+        return [(row['id'], row['file_path']) for row in rows]
+
+    def claim(self, job_id):
+        """Mark a queued job as running. Only one caller (thread or worker process) wins."""
+        with self._connect() as db:
+            claimed = db.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), time.time(), job_id)
+            ).rowcount
+        return claimed == 1
+
+    def beat(self, job_ids):
+        """Record that the process running these jobs is still alive."""
+        with self._connect() as db:
+            db.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                           [(time.time(), job_id) for job_id in job_ids])
+
+    def requeue_stale(self, beat_before):
+        """Put running jobs whose last heartbeat is older than beat_before back to queued
+        (or cancel them, when that was asked for). Returns the ids of the requeued jobs and
+        the upload paths of the cancelled ones."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT id, cancel_requested, file_path FROM jobs WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < ?",
+                (beat_before,)
+            ).fetchall()
+            requeued, cancelled = [], []
+            for row in rows:
+                # The status check makes sure a job that just finished isn't touched
+                if row['cancel_requested']:
+                    if db.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'running'",
+                                  (time.time(), row['id'])).rowcount:
+                        cancelled.append(row['file_path'])
+                elif db.execute("UPDATE jobs SET status = 'queued', pages_done = 0 WHERE id = ? AND status = 'running'",
+                                (row['id'],)).rowcount:
+                    requeued.append(row['id'])
+        return requeued, cancelled
+
+    def requeue(self, job_ids=None):
+        """Put running jobs (all of them, or just job_ids) back to queued, to start over."""
+        with self._connect() as db:
+            if job_ids is None:
+                return db.execute("UPDATE jobs SET status = 'queued', pages_done = 0 WHERE status = 'running'").rowcount
+            return sum(
+                db.execute("UPDATE jobs SET status = 'queued', pages_done = 0 WHERE id = ? AND status = 'running'",
+                           (job_id,)).rowcount
+                for job_id in job_ids
+            )
+
+    def queued(self):
+        with self._connect() as db:
+            rows = db.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        return [row['id'] for row in rows]
+
+
+store = JobStore(os.path.join(JOBS_DIR, 'jobs.db'))
+_queue = queue.Queue(maxsize=JOB_QUEUE_SIZE)
+_workers = []
+_workers_lock = threading.Lock()
+# Jobs this process is running right now
+_running = set()
+
+
+def submit_job(params, file=None):
+    """Save the upload, record the job and queue it. Raises QueueFull when we're too busy."""
+    job_id = uuid.uuid4().hex
+    file_path = None
+    if file:
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        file_path = os.path.join(JOBS_DIR, f"{job_id}.upload")
+        file.save(file_path)
+
+    store.create(job_id, params, file.filename if file else None, file.mimetype if file else None, file_path)
+    try:
+        _queue.put_nowait(job_id)
+    except queue.Full:
+        store.delete(job_id)
+        _remove_upload(file_path)
+        raise QueueFull(f"Job queue is full ({JOB_QUEUE_SIZE} jobs waiting), try again later")
+    return job_id
+
+
+def cancel_job(job_id):
+    """Ask a job to stop. Queued jobs never start, running jobs stop after the current page."""
+    job = store.get(job_id)
+    if job is None or job['status'] in FINISHED:
+        return job
+    if store.cancel_queued(job_id):
+        # It will never run, so nobody else is going to delete the upload
+        _remove_upload(job['file_path'])
+    else:
+        store.update(job_id, cancel_requested=1)
+    return store.get(job_id)
+
+
+def job_status(job):
+    """The public view of a job: everything except the (possibly large) result."""
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'filename': job['filename'],
+        'page_count': job['page_count'],
+        'pages_done': job['pages_done'],
+        'cancel_requested': bool(job['cancel_requested']),
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+    }
+
+
+def _remove_upload(file_path):
+    if file_path and os.path.exists(file_path):
+        try:
+            os.remove(file_path)
+        except OSError as e:
+            logger.warning(f"Removing job upload failed: {str(e)}")
+
+
+def _cancelled(job_id):
+    return bool(store.get(job_id)['cancel_requested'])
+
+
+def _process_job(job_id, job):
+    """The job's result and pages, or None when it was cancelled halfway."""
+    params = job['params']
+    option = params.get('option', 'ocr')
+    text = params.get('text', '')
+    pages = []
+    if job['file_path']:
+        lang = ocr_language(option, params.get('source_lang', 'auto'), params.get('target_lang', 'en'))
+        # Images are decoded and PDFs copied inside open_pages, so the file can close right after
+        with open(job['file_path'], 'rb') as f:
+            page_count, sources = open_pages(f, job['mimetype'], params.get('dpi'))
+        store.update(job_id, page_count=page_count)
+
+        results = []
+        for page in iter_ocr_pages(sources, page_count, lang, params.get('mode')):
+            pages.append(page)
+            result = page_result(page)
+            if result is not None:
+                results.append(result)
+            store.update(job_id, pages_done=len(pages))
+            if _cancelled(job_id):
+                store.update(job_id, status='cancelled', finished_at=time.time())
+                return None
+        text = '\n'.join(results) if results else "No text extracted"
+
+    if option == 'translate':
+        result = translate_text(text, None, params.get('source_lang', 'auto'), params.get('target_lang', 'en'), params.get('profile'))
+    else:
+        result = text
+    return {'result': result, 'pages': pages}
+
+
+def _run_job(job_id):
+    """Run the usual OCR/translate pipeline for one job, recording progress page by page."""
+    job = store.get(job_id)
+    if job is None:
+        return
+
+    # With several worker processes the same job can be in more than one queue, only one runs it
+    if job['status'] in FINISHED or not store.claim(job_id):
+        # Cancelled while queued: make sure its upload doesn't stay behind
+        current = store.get(job_id)
+        if current is not None and current['status'] in FINISHED:
+            _remove_upload(job['file_path'])
+        return
+
+    _running.add(job_id)
+    try:
+        with tracing(bool(job['params'].get('trace'))) as trace:
+            processed = _process_job(job_id, job)
+        if processed is None:
+            return  # Cancelled while running
+        if trace is not None:
+            processed['trace'] = trace.to_dict()
+        store.update(job_id, status='done', result=json.dumps(processed), finished_at=time.time())
+        logger.info(f"Job {job_id} done, result length: {len(processed['result'])}")
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {str(e)}")
+        store.update(job_id, status='failed', error=str(e), finished_at=time.time())
+    finally:
+        _running.discard(job_id)
+        if store.get(job_id)['status'] in FINISHED:
+            _remove_upload(job['file_path'])
+
+
+def _worker():
+    while True:
+        job_id = _queue.get()
+        try:
+            _run_job(job_id)
+        except Exception as e:
+            logger.error(f"Job worker error: {str(e)}")
+        finally:
+            _queue.task_done()
+
+
+def purge_expired_jobs(retention_hours=JOB_RETENTION_HOURS):
+    """Delete finished jobs older than the retention period, with their uploads."""
+    if retention_hours <= 0 or not os.path.exists(store.path):
+        return 0
+    expired = store.expired(time.time() - retention_hours * 3600)
+    for job_id, file_path in expired:
+        _remove_upload(file_path)
+        store.delete(job_id)
+    if expired:
+        logger.info(f"Purged {len(expired)} finished jobs older than {retention_hours:g}h")
+    return len(expired)
+
+
+def _sweeper():
+    while True:
+        try:
+            purge_expired_jobs()
+        except Exception as e:
+            logger.error(f"Purging old jobs failed: {str(e)}")
+        time.sleep(min(max(JOB_RETENTION_HOURS * 3600 / 4, 60), 3600))
+
+
+def requeue_stale_jobs(stale_seconds=JOB_STALE_SECONDS):
+    """Start over the running jobs nobody has checked in for, e.g. because their worker
+    was killed (SIGKILL, out of memory) before it could hand them back. Returns their ids."""
+    if stale_seconds <= 0 or not os.path.exists(store.path):
+        return []
+    job_ids, cancelled = store.requeue_stale(time.time() - stale_seconds)
+    for file_path in cancelled:
+        _remove_upload(file_path)
+    if job_ids:
+        logger.warning(f"Requeued {len(job_ids)} jobs whose worker stopped responding")
+    return job_ids
+
+
+def _enqueue(job_ids):
+    for job_id in job_ids:
+        _queue.put(job_id)  # Blocks while the queue is full, that's fine in this thread
+
+
+def _heartbeat():
+    """Check in for the jobs this process runs, and take over jobs of processes that stopped."""
+    while True:
+        time.sleep(JOB_STALE_SECONDS / 4)
+        try:
+            if _running:
+                store.beat(list(_running))
+            job_ids = requeue_stale_jobs()
+            if job_ids:
+                threading.Thread(target=_enqueue, args=(job_ids,), name='job-requeue', daemon=True).start()
+        except Exception as e:
+            logger.error(f"Job heartbeat failed: {str(e)}")
+
+
+def reset_running_jobs():
+    """Jobs marked running when the server stopped start over. Only call this while no
+    process is running jobs (at startup, or in the gunicorn master before forking)."""
+    if not os.path.exists(store.path):
+        return 0
+    count = store.requeue()
+    if count:
+        logger.info(f"Reset {count} interrupted jobs")
+    return count
+
+
+def release_running_jobs():
+    """Hand the jobs this process is running back to the queue, e.g. when a worker is recycled."""
+    if _running:
+        count = store.requeue(list(_running))
+        logger.info(f"Released {count} running jobs")
+
+
+def _requeue_unfinished():
+    """Queue every job that is waiting in the database."""
+    if not os.path.exists(store.path):
+        return
+    job_ids = store.queued()
+    _enqueue(job_ids)
+    if job_ids:
+        logger.info(f"Requeued {len(job_ids)} unfinished jobs")
+
+
+def start_job_workers(workers=JOB_WORKERS, reset_running=True):
+    """Start the worker pool (once) and pick up jobs left over from the last run.
+    Worker processes pass reset_running=False, the master already did that."""
+    with _workers_lock:
+        if _workers:
+            return
+        if reset_running:
+            reset_running_jobs()
+        for i in range(workers):
+            thread = threading.Thread(target=_worker, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            _workers.append(thread)
+    threading.Thread(target=_requeue_unfinished, name='job-requeue', daemon=True).start()
+    if JOB_RETENTION_HOURS > 0:
+        threading.Thread(target=_sweeper, name='job-sweeper', daemon=True).start()
+    if JOB_STALE_SECONDS > 0:
+        threading.Thread(target=_heartbeat, name='job-heartbeat', daemon=True).start()
@@ -0,0 +1,181 @@
+'''
+This file keeps the numbers behind the /metrics endpoint: latency histograms, counters
+and gauges, printed in the Prometheus text format. It can also record a trace of one
+request (every stage with its start and duration), returned when the client asks for it.
+
+Timing a piece of the pipeline looks like this:
+
+    with stage('decode'):
+        image = load_image(source)
+
+which adds the time to the `ocr_stage_seconds` histogram, and to the request's trace when
+the request is being traced. Everything is kept in memory, per process.
+'''
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# OCR_METRICS=0 stops collecting histograms and counters (traces still work)
+METRICS_ENABLED = os.environ.get('OCR_METRICS', '1') != '0'
+# OCR_LOG_TEXT=0 stops logging snippets of the recognized and translated text
+LOG_TEXT = os.environ.get('OCR_LOG_TEXT', '1') != '0'
+# Histogram buckets in seconds, from a thumbnail resize to a long PDF
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Metrics:
+    """Counters and histograms by name and labels, plus gauges read from collectors at scrape time."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # One count per bucket, then the sum and the total count
+                histogram = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def add_collector(self, collect):
+        """collect() returns (name, kind, help, labels dict, value) tuples, read on every scrape."""
+        self._collectors.append(collect)
+
+    def render(self):
+        """Everything in the Prometheus text exposition format."""
+        samples = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append(f"{name}{_labels(labels)} {value}")
+            for (name, labels), histogram in self._histograms.items():
+                lines = samples.setdefault(name, [])
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+                lines.append(f"{name}_sum{_labels(labels)} {round(histogram[-2], 6)}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram[-1]}")
+
+        for collect in self._collectors:
+            try:
+                for name, kind, help_text, labels, value in collect():
+                    self._help.setdefault(name, (kind, help_text))
+                    if value is not None:
+                        samples.setdefault(name, []).append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {str(e)}")
+
+        output = []
+        for name in sorted(samples):
+            kind, help_text = self._help.get(name, ('untyped', ''))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(samples[name])
+        return '\n'.join(output) + '\n'
+
+
+metrics = Metrics()
+metrics.describe('ocr_stage_seconds', 'histogram', 'Time spent in each pipeline stage.')
+metrics.describe('ocr_request_seconds', 'histogram', 'Time to answer a request, by route.')
+metrics.describe('ocr_requests_total', 'counter', 'Requests answered, by route and status code.')
+metrics.describe('ocr_engine_calls_total', 'counter', 'OCR engine runs by outcome (text, empty, error, timeout).')
+metrics.describe('ocr_engine_errors_total', 'counter', 'OCR engine runs that raised an error.')
+metrics.describe('ocr_pages_total', 'counter', 'Pages processed, by page type and source.')
+metrics.describe('ocr_cascade_tier_total', 'counter', 'Cascade mode pages by the tier that produced the text.')
+metrics.describe('ocr_translation_errors_total', 'counter', 'Translations that failed.')
+
+
+class Trace:
+    """Stages of one request with their start offset and duration in milliseconds."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, seconds, labels):
+        span = {'stage': name, 'start_ms': round((start - self.start) * 1000, 2), 'ms': round(seconds * 1000, 2)}
+        span.update(labels)
+        span['thread'] = threading.current_thread().name
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start_ms'])
+        return {'total_ms': round((time.perf_counter() - self.start) * 1000, 2), 'spans': spans}
+
+
+# The trace of the request this code runs for, if it is being traced. executor.py copies
+# the context into the engine threads, so their stages end up in the same trace.
+_current_trace = contextvars.ContextVar('ocr_trace', default=None)
+
+
+@contextmanager
+def tracing(enabled=True):
+    """Trace everything timed with stage() inside the block. Yields the Trace (or None)."""
+    if not enabled:
+        yield None
+        return
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record(name, seconds, start=None, **labels):
+    """Add a stage that was already timed elsewhere."""
+    metrics.observe('ocr_stage_seconds', seconds, stage=name, **labels)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start if start is not None else time.perf_counter() - seconds, seconds, labels)
+
+
+@contextmanager
+def stage(name, **labels):
+    """Time the block as one pipeline stage (labels like engine='tesseract' are kept apart)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, start, **labels)
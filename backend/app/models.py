@@ -0,0 +1,251 @@
+'''
+This file keeps track of the heavy machine learning models (TrOCR, EasyOCR, M2M100).
+Nothing is loaded when the app starts. Each model is loaded the first time someone asks
+for it, and can be warmed up ahead of time or unloaded again when it sits idle.
+'''
+
+import gc
+import logging
+import os
+import threading
+import time
+
+from .metrics import metrics
+
+try:
+    import psutil
+except ImportError:  # psutil is optional, we fall back to /proc below
+    psutil = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Models that were not used for this many seconds get unloaded by the idle reaper (0 = never)
+MODEL_IDLE_SECONDS = float(os.environ.get('OCR_MODEL_IDLE_SECONDS', '0'))
+# How often PeakRSS samples the memory of the process
+MEMORY_SAMPLE_MS = float(os.environ.get('OCR_MEMORY_SAMPLE_MS', '10'))
+
+
+def current_rss():
+    """Resident memory of this process in bytes (0 if we can't tell)."""
+    try:
+        if psutil is not None:
+            return psutil.Process(os.getpid()).memory_info().rss
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return 0
+
+
+def private_memory():
+    """Memory only this process uses (USS): pages shared copy-on-write with the gunicorn
+    master or other workers are left out, unlike in the RSS. 0 if we can't tell."""
+    try:
+        # smaps_rollup is cheap to read, psutil's memory_full_info walks every mapping
+        with open('/proc/self/smaps_rollup') as f:
+            return sum(int(line.split()[1]) * 1024 for line in f if line.startswith(('Private_Clean:', 'Private_Dirty:')))
+    except OSError:
+        pass
+    try:
+        if psutil is not None:
+            return psutil.Process(os.getpid()).memory_full_info().uss
+    except Exception:
+        pass
+    return 0
+
+
+class PeakRSS:
+    """Context manager that samples the process RSS in the background while a block runs.
+    Requests running at the same time share the process, so with concurrency the
+    numbers are an upper bound for any single request."""
+
+    def __init__(self, interval_ms=MEMORY_SAMPLE_MS):
+        self.interval = interval_ms / 1000.0
+        self.start = self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, name='peak-rss', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        return False
+
+    def stats(self):
+        return {
+            'rss_start_bytes': self.start,
+            'rss_peak_bytes': self.peak,
+            'peak_increase_bytes': max(self.peak - self.start, 0),
+        }
+
+
+class ModelRegistry:
+    """Loads models on first use and remembers how expensive each one was."""
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._info = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def register(self, name, loader, description=''):
+        """Tell the registry how to build a model. Nothing is loaded yet."""
+        with self._lock:
+            self._loaders[name] = loader
+            self._load_locks.setdefault(name, threading.Lock())
+            self._info.setdefault(name, {
+                'description': description,
+                'loaded': False,
+                'load_seconds': None,
+                'rss_bytes': None,
+                'loads': 0,
+                'last_used': None,
+            })
+
+    def names(self):
+        return list(self._loaders)
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def get(self, name):
+        """Return the model, loading it first if this is the first time it's needed."""
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: {name}")
+
+        model = self._models.get(name)
+        if model is None:
+            # Only one thread loads a given model, the others wait for it
+            with self._load_locks[name]:
+                model = self._models.get(name)
+                if model is None:
+                    model = self._load(name)
+
+        self._info[name]['last_used'] = time.time()
+        return model
+
+    def _load(self, name):
+        logger.info(f"Loading model '{name}'...")
+        rss_before = current_rss()
+        start = time.perf_counter()
+        model = self._loaders[name]()
+        elapsed = time.perf_counter() - start
+        rss_after = current_rss()
+
+        with self._lock:
+            self._models[name] = model
+            info = self._info[name]
+            info['loaded'] = True
+            info['load_seconds'] = round(elapsed, 3)
+            # RSS delta is approximate when two models load at the same time
+            info['rss_bytes'] = max(rss_after - rss_before, 0) if rss_before else None
+            info['loads'] += 1
+
+        logger.info(f"Model '{name}' loaded in {elapsed:.2f}s (~{(info['rss_bytes'] or 0) / 2**20:.0f} MiB)")
+        return model
+
+    def warm(self, names=None):
+        """Load the given models (or all of them) now instead of on the first request."""
+        for name in names or self.names():
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.error(f"Warming model '{name}' failed: {str(e)}")
+        return self.stats()
+
+    def unload(self, name):
+        """Drop a model so its memory can be given back."""
+        with self._load_locks.get(name, threading.Lock()):
+            with self._lock:
+                model = self._models.pop(name, None)
+                if model is None:
+                    return False
+                self._info[name]['loaded'] = False
+        del model
+        gc.collect()
+        logger.info(f"Model '{name}' unloaded")
+        return True
+
+    def unload_idle(self, max_idle_seconds):
+        """Unload every model that hasn't been used for max_idle_seconds."""
+        now = time.time()
+        unloaded = []
+        for name in list(self._models):
+            last_used = self._info[name]['last_used'] or 0
+            if now - last_used >= max_idle_seconds and self.unload(name):
+                unloaded.append(name)
+        return unloaded
+
+    def enforce_budget(self, names, budget_bytes, keep=None):
+        """Unload the least recently used of the given models until the memory they took
+        when loading fits in budget_bytes. keep (e.g. the model just loaded) always stays."""
+        unloaded = []
+        while True:
+            with self._lock:
+                loaded = [name for name in names if name in self._models]
+                used = sum(self._info[name]['rss_bytes'] or 0 for name in loaded)
+                candidates = sorted(
+                    (name for name in loaded if name != keep),
+                    key=lambda name: self._info[name]['last_used'] or 0
+                )
+            if used <= budget_bytes or not candidates:
+                return unloaded
+            logger.info(f"Models use {used / 2**20:.0f} MiB of a {budget_bytes / 2**20:.0f} MiB budget, unloading '{candidates[0]}'")
+            if self.unload(candidates[0]):
+                unloaded.append(candidates[0])
+
+    def stats(self):
+        """Load time, memory and usage info for every registered model."""
+        with self._lock:
+            return {name: dict(info) for name, info in self._info.items()}
+
+
+registry = ModelRegistry()
+
+
+def _model_metrics():
+    """Model and memory gauges for /metrics."""
+    yield 'ocr_process_rss_bytes', 'gauge', 'Resident memory of this process.', {}, current_rss()
+    yield 'ocr_process_private_bytes', 'gauge', 'Memory not shared with other processes (USS).', {}, private_memory()
+    for name, info in registry.stats().items():
+        labels = {'model': name}
+        yield 'ocr_model_loaded', 'gauge', 'Whether the model is loaded (1) or not (0).', labels, int(info['loaded'])
+        yield 'ocr_model_loads_total', 'counter', 'Times the model was loaded.', labels, info['loads']
+        yield 'ocr_model_load_seconds', 'gauge', 'How long the last load of the model took.', labels, info['load_seconds']
+        yield 'ocr_model_rss_bytes', 'gauge', 'Memory the model took when it was loaded.', labels, info['rss_bytes']
+
+
+metrics.add_collector(_model_metrics)
+
+_reaper = None
+
+
+def start_idle_reaper(max_idle_seconds=MODEL_IDLE_SECONDS):
+    """Start a background thread that unloads models nobody has used for a while."""
+    global _reaper
+    if max_idle_seconds <= 0 or _reaper is not None:
+        return
+
+    def reap():
+        while True:
+            time.sleep(max(max_idle_seconds / 4, 1))
+            try:
+                unloaded = registry.unload_idle(max_idle_seconds)
+                if unloaded:
+                    logger.info(f"Unloaded idle models: {unloaded}")
+            except Exception as e:
+                logger.error(f"Idle model reaper failed: {str(e)}")
+
+    _reaper = threading.Thread(target=reap, name='model-idle-reaper', daemon=True)
+    _reaper.start()
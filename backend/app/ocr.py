@@ -3,131 +3,614 @@ This file is the brain behind turning images (e.g., Scanned, documents or screen
 into text we can read and use.
 '''
 
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-from PIL import Image, ImageEnhance, ImageOps
+from PIL import Image
 import io
 import logging
-import pytesseract
-import easyocr
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_path, pdfinfo_from_path
 import os
 import numpy as np
+import contextlib
 import cv2
+import functools
 import re
-
-# This one is default for Ubuntu users, but for the people using Windows, they need to configure this once.
-pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from .models import registry, PeakRSS
+from .executor import register_engine, run_engines_detailed, count_engine_call
+from .cache import ocr_cache, image_key
+from .scheduler import BatchScheduler
+from .backends import MODEL_BACKEND, register_backend_model, load_backend_model, render_text_line
+from .tesseract import recognize, backend_name as tesseract_backend
+from .metrics import metrics, stage, record, LOG_TEXT
 
 # Set up logging
 # This helps track the flow of the program.
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load the TrOCR model and processor for printed text, force CPU usage
-processor = TrOCRProcessor.from_pretrained('microsoft/trocr-base-printed', use_fast=True)
-model = VisionEncoderDecoderModel.from_pretrained('microsoft/trocr-base-printed').to('cpu')
-
-# Initialize two EasyOCR readers to handle language compatibility
-latin_reader = easyocr.Reader(['en', 'fr', 'de'], gpu=False)  # For Latin-script languages
-devanagari_reader = easyocr.Reader(['hi', 'en'], gpu=False)  # For Devanagari-script languages (Hindi + English)
+# 'all' runs every engine on every page. 'cascade' runs Tesseract first and only calls
+# EasyOCR and TrOCR when Tesseract isn't confident enough. Can be overridden per request.
+OCR_MODE = os.environ.get('OCR_MODE', 'all')
+# Cascade thresholds: mean word confidence (0-100) and share of words above CASCADE_WORD_CONFIDENCE
+CASCADE_MIN_CONFIDENCE = float(os.environ.get('OCR_CASCADE_MIN_CONFIDENCE', '80'))
+CASCADE_MIN_COVERAGE = float(os.environ.get('OCR_CASCADE_MIN_COVERAGE', '0.9'))
+CASCADE_WORD_CONFIDENCE = float(os.environ.get('OCR_CASCADE_WORD_CONFIDENCE', '60'))
+
+# PDFs are rendered a few pages at a time at this DPI, so memory stays at a few pages
+# no matter how long the document is (pdf2image's default DPI is 200)
+PDF_DPI = int(os.environ.get('OCR_PDF_DPI', '200'))
+PDF_PAGE_BATCH = int(os.environ.get('OCR_PDF_PAGE_BATCH', '2'))
+# TrOCR reads one line at a time: line crops are decoded this many per batch,
+# each line allowed up to TROCR_MAX_LINE_LENGTH tokens
+TROCR_BATCH_SIZE = int(os.environ.get('OCR_TROCR_BATCH_SIZE', '8'))
+TROCR_MAX_LINE_LENGTH = int(os.environ.get('OCR_TROCR_MAX_LINE_LENGTH', '64'))
+# Born-digital PDFs already carry their text. Pages whose embedded text has at least
+# this many letters/digits are returned as-is and never rasterized or OCR'd.
+PDF_TEXT_LAYER = os.environ.get('OCR_PDF_TEXT_LAYER', '1') != '0'
+PDF_TEXT_MIN_CHARS = int(os.environ.get('OCR_PDF_TEXT_MIN_CHARS', '20'))
+# Ingest limits: bigger uploads are refused (Flask answers 413), and images with more
+# pixels than this are refused before they are decoded
+MAX_UPLOAD_BYTES = int(float(os.environ.get('OCR_MAX_UPLOAD_MB', '100')) * 2**20)
+MAX_IMAGE_PIXELS = int(os.environ.get('OCR_MAX_IMAGE_PIXELS', '100000000'))
+# Large JPEGs (phone photos) are decoded straight at 1/2, 1/4 or 1/8 scale, as long as
+# the longer side stays at least this long (a 12MP photo is decoded at 2016x1512)
+MAX_DECODE_SIDE = int(os.environ.get('OCR_MAX_DECODE_SIDE', '2000'))
+# Uploads we have to keep past the request are spooled, in memory up to this size, then on disk
+UPLOAD_SPOOL_BYTES = int(float(os.environ.get('OCR_UPLOAD_SPOOL_MB', '8')) * 2**20)
+
+# The heavy models are only loaded the first time an engine needs them (see models.py),
+# so a worker that only ever runs Tesseract never pays for TrOCR or EasyOCR.
+TROCR_MODEL = 'microsoft/trocr-base-printed'
+
+@functools.lru_cache(maxsize=None)
+def _trocr_processor():
+    from transformers import TrOCRProcessor
+    return TrOCRProcessor.from_pretrained(TROCR_MODEL, use_fast=True)
+
+def _load_trocr_fp32():
+    """Load the TrOCR model for printed text, force CPU usage."""
+    from transformers import VisionEncoderDecoderModel
+    return VisionEncoderDecoderModel.from_pretrained(TROCR_MODEL).to('cpu')
+
+def _load_trocr():
+    # The model runs on OCR_MODEL_BACKEND (fp32, int8 or onnx, see backends.py)
+    return _trocr_processor(), load_backend_model('trocr')
+
+# EasyOCR can only mix languages of compatible scripts in one reader, so there is one
+# reader per script group, built the first time a page in one of its languages comes in.
+# All readers share a single text detector (CRAFT), only the recognizers differ.
+EASYOCR_GROUPS = {
+    'latin': ['en', 'fr', 'de', 'es'],
+    'cyrillic': ['ru', 'en'],
+    'devanagari': ['hi', 'en'],
+    'tamil': ['ta', 'en'],
+}
+EASYOCR_LANG_GROUP = {lang: group for group, languages in reversed(list(EASYOCR_GROUPS.items())) for lang in languages}
+# Memory the readers may take together before the least recently used one is unloaded (MiB, 0 = no limit)
+EASYOCR_MEMORY_MB = float(os.environ.get('OCR_EASYOCR_MEMORY_MB', '1024'))
+
+def _load_easyocr_detector():
+    import easyocr
+    return easyocr.Reader(['en'], gpu=False, recognizer=False)
+
+def _load_easyocr(languages):
+    import easyocr
+    reader = easyocr.Reader(languages, gpu=False, detector=False)
+    # Borrow the shared detector instead of loading another copy of CRAFT
+    detector = registry.get('easyocr_detector')
+    for attr in ('detector', 'detect_network', 'get_detector', 'get_textbox'):
+        if hasattr(detector, attr):
+            setattr(reader, attr, getattr(detector, attr))
+    return reader
+
+registry.register('trocr', _load_trocr, f'TrOCR base (printed, {MODEL_BACKEND})')
+registry.register('easyocr_detector', _load_easyocr_detector, 'EasyOCR text detector (CRAFT), shared by all readers')
+for _group, _languages in EASYOCR_GROUPS.items():
+    registry.register(f'easyocr_{_group}', functools.partial(_load_easyocr, _languages),
+                      f"EasyOCR {_group}-script reader ({', '.join(_languages)})")
+EASYOCR_READERS = [f'easyocr_{group}' for group in EASYOCR_GROUPS]
+_easyocr_evictions = []
+
+def easyocr_reader(lang):
+    """The reader for the script group of lang, built on first use within the memory budget."""
+    name = f"easyocr_{EASYOCR_LANG_GROUP.get(lang, 'latin')}"
+    # Load the detector on its own first, so each reader's memory is only its recognizer
+    registry.get('easyocr_detector')
+    loaded = registry.is_loaded(name)
+    reader = registry.get(name)
+    if not loaded and EASYOCR_MEMORY_MB > 0:
+        _easyocr_evictions.extend(registry.enforce_budget(EASYOCR_READERS, EASYOCR_MEMORY_MB * 2**20, keep=name))
+    return reader
+
+def easyocr_stats():
+    """Which readers are loaded, what they cost and what the budget had to unload."""
+    models = registry.stats()
+    readers = {name: models[name] for name in EASYOCR_READERS + ['easyocr_detector']}
+    return {
+        'memory_budget_bytes': int(EASYOCR_MEMORY_MB * 2**20) if EASYOCR_MEMORY_MB > 0 else None,
+        'readers_rss_bytes': sum(info['rss_bytes'] or 0 for name, info in readers.items()
+                                 if info['loaded'] and name != 'easyocr_detector'),
+        'evictions': len(_easyocr_evictions),
+        'readers': readers,
+    }
+
+# This checks if an image has code, so we treat it differently.
+# 'classifier' looks at the layout of a small thumbnail (a few milliseconds),
+# 'tesseract' is the old check that OCRs the whole page and looks for code characters.
+CODE_DETECTOR = os.environ.get('OCR_CODE_DETECTOR', 'classifier')
+CODE_THRESHOLD = float(os.environ.get('OCR_CODE_THRESHOLD', '0.5'))
+THUMBNAIL_SIZE = 800
+
+# Instead of blowing every page up to 4000px, pages are resized so their text ends up
+# at an x-height (height of a lowercase 'x', in pixels) each engine reads well.
+# Text that is already at least MIN_X_HEIGHT tall is never upscaled.
+TARGET_X_HEIGHT = {
+    'tesseract': float(os.environ.get('OCR_TESSERACT_X_HEIGHT', '24')),
+    'code': float(os.environ.get('OCR_CODE_X_HEIGHT', '24')),
+}
+MIN_X_HEIGHT = float(os.environ.get('OCR_MIN_X_HEIGHT', '16'))
+MAX_UPSCALE = 4.0
+MAX_PREPROCESS_SIDE = 4000
+
+# Sparse pages (forms, receipts, slides) are cut into their text regions and the
+# engines only read those. Pages where text covers more than REGION_MAX_COVERAGE of
+# the area, or with more than MAX_TEXT_REGIONS regions, are still read as a whole.
+TEXT_REGIONS = os.environ.get('OCR_TEXT_REGIONS', '1') != '0'
+REGION_MAX_COVERAGE = float(os.environ.get('OCR_REGION_MAX_COVERAGE', '0.5'))
+MAX_TEXT_REGIONS = int(os.environ.get('OCR_MAX_TEXT_REGIONS', '16'))
+
+def make_thumbnail(image, max_side=THUMBNAIL_SIZE):
+    """Small RGB copy of the page for cheap layout analysis."""
+    # resize() straight to the small size, copying the full page first would double its memory
+    scale = min(1.0, max_side / max(image.size))
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # reducing_gap shrinks by whole factors first, which is much faster on big pages
+    thumbnail = image.resize(size, Image.Resampling.BILINEAR, reducing_gap=3.0) if scale < 1.0 else image.copy()
+    return thumbnail.convert('RGB') if thumbnail.mode != 'RGB' else thumbnail
+
+def code_features(thumbnail):
+    """Layout features that tell code screenshots apart from documents, each 0..1."""
+    rgb = np.array(thumbnail)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    background = float(np.median(gray))
+
+    # Editors and terminals usually have a dark background
+    dark = 1.0 if background < 110 else 0.0
+
+    # Syntax highlighting: the "ink" (pixels far from the background) is colourful
+    ink = np.abs(gray.astype(np.int16) - background) > 60
+    if np.count_nonzero(ink) > 50:
+        saturation = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)[..., 1][ink].mean() / 255.0
+        color = min(max((saturation - 0.15) / 0.25, 0.0), 1.0)
+    else:
+        color = 0.0
+
+    # Indentation and ragged lines: code lines start at several indentation columns and
+    # vary a lot in length, prose lines mostly start at one margin and run to the other
+    lines = find_text_lines(thumbnail, max_side=max(thumbnail.size))
+    indent = ragged = 0.0
+    if len(lines) >= 3:
+        width = thumbnail.width
+        lefts = sorted(box[0] for box in lines)
+        tolerance = max(4, width * 0.01)
+        levels = 1 + sum(1 for a, b in zip(lefts, lefts[1:]) if b - a > tolerance)
+        indented = sum(1 for left in lefts if left > lefts[0] + tolerance) / len(lefts)
+        if levels >= 2:
+            indent = min(indented * 2, 1.0)
+        widths = np.array([box[2] - box[0] for box in lines], dtype=float)
+        variation = widths.std() / widths.mean() if widths.mean() else 0.0
+        ragged = min(max((variation - 0.2) / 0.3, 0.0), 1.0)
+
+    return {'dark': dark, 'color': color, 'indent': indent, 'ragged': ragged, 'lines': len(lines)}
+
+def classify_code_image(image):
+    """Fast code-screenshot check on a thumbnail. Returns (is_code, confidence 0..1)."""
+    page = as_page(image)
+    features = code_features(page.variant('thumbnail'))
+    # Weights hand-tuned on the rendered corpus in benchmarks/corpus.py only, see the README
+    score = -2.5 + 2.5 * features['dark'] + 2.0 * features['color'] + 2.0 * features['indent'] + 1.0 * features['ragged']
+    confidence = float(1.0 / (1.0 + np.exp(-score)))
+    return confidence >= CODE_THRESHOLD, confidence
+
+def is_code_image_tesseract(image):
+    """The original check: OCR the whole page and look for code-like characters."""
+    # Reuse the Tesseract variant, the engines will need it anyway
+    image = as_page(image).variant('tesseract')
+    text = recognize(image, 'eng', psm=6)['text']
+    # Looks for code-like patterns
+    code_indicators = ['def ', 'if ', 'try:', '# ', ' = ', '(', ')', '{', '}']
+    return any(indicator in text for indicator in code_indicators)
+
+def detect_code(image):
+    """Returns (is_code, confidence) using the configured detector."""
+    try:
+        with stage('code_detection'):
+            if CODE_DETECTOR == 'tesseract':
+                is_code = is_code_image_tesseract(image)
+                confidence = 1.0 if is_code else 0.0
+            else:
+                is_code, confidence = classify_code_image(image)
+        logger.info(f"Code detection result: {is_code} (confidence {confidence:.2f})")
+        return is_code, confidence
+    except Exception as e:
+        logger.warning(f"Code detection failed: {str(e)}, defaulting to non-code")
+        return False, 0.0
 
-# This checks if an image has code, so we treat it differently
 def is_code_image(image):
     """In this part, we try to detect whether the screenshot or the image that has been taken contains CODING SNIPPET or not"""
+    return detect_code(image)[0]
+
+def estimate_x_height(thumbnail, width):
+    """Typical lowercase letter height in pixels of the full-size page (None without text).
+
+    Uses the connected components ("blobs of ink") of the thumbnail, width is the
+    width of the full-size page."""
     try:
-        # Preprocess lightly for detection
-        image = preprocess_image(image, for_tesseract=True)
-        text = pytesseract.image_to_string(image, config="--psm 6 --oem 3 -l eng")
-        # Looks for code-like patterns
-        code_indicators = ['def ', 'if ', 'try:', '# ', ' = ', '(', ')', '{', '}']
-        is_code = any(indicator in text for indicator in code_indicators)
-        logger.info(f"Code detection result: {is_code}")
-        return is_code
+        gray = cv2.cvtColor(np.array(thumbnail), cv2.COLOR_RGB2GRAY)
+        binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+        if np.count_nonzero(binary) > binary.size / 2:
+            binary = cv2.bitwise_not(binary)
+        stats = cv2.connectedComponentsWithStats(binary, connectivity=8)[2][1:]
+        heights = stats[:, cv2.CC_STAT_HEIGHT]
+        widths = stats[:, cv2.CC_STAT_WIDTH]
+        # Letter-shaped blobs only: no specks, rules, pictures or letters merged into words
+        letters = ((heights >= 2) & (heights <= binary.shape[0] / 10)
+                   & (widths <= heights * 1.5) & (stats[:, cv2.CC_STAT_AREA] >= 3))
+        if np.count_nonzero(letters) < 10:
+            return None
+        # Lower than the median, capitals and ascenders make letters look taller than an 'x'
+        return float(np.percentile(heights[letters], 30)) * width / thumbnail.width
     except Exception as e:
-        logger.warning(f"Code detection failed: {str(e)}, defaulting to non-code")
-        return False
-
-def preprocess_image(image, for_tesseract=False):
+        logger.warning(f"Text size estimation failed: {str(e)}")
+        return None
+
+def text_scale(x_height, target, size):
+    """Resize factor that brings the text close to the target x-height."""
+    if not x_height:
+        scale = 1.0  # No text found, keep the size (huge scans still get the side cap below)
+    else:
+        scale = target / x_height
+        if scale > 1.0 and x_height >= MIN_X_HEIGHT:
+            scale = 1.0  # Big enough already, upscaling only costs time
+        elif 0.67 < scale < 1.0:
+            scale = 1.0  # Close enough, not worth a resize
+    scale = min(scale, MAX_UPSCALE, MAX_PREPROCESS_SIDE / max(size))
+    return round(scale, 3)
+
+def _step(report, name, start):
+    """Record how long a preprocessing step took, returns the start of the next one."""
+    now = time.perf_counter()
+    if report is not None:
+        report.setdefault('steps_ms', {})[name] = round((now - start) * 1000, 2)
+    return now
+
+def scaled_gray(image, ratio, report=None, border=10):
+    """Grayscale copy of the page resized by ratio, with a white border so text near the
+    edges isn't cut off. Converting to gray first means the resize and the padding work
+    on one channel instead of three, and only the gray image is ever copied."""
+    start = time.perf_counter()
+    gray = image.convert('L')
+    start = _step(report, 'gray', start)
+
+    if ratio != 1.0:
+        new_size = (max(1, int(gray.width * ratio)), max(1, int(gray.height * ratio)))
+        # LANCZOS for upscaling, BOX is faster and just as clean for shrinking
+        gray = gray.resize(new_size, Image.Resampling.LANCZOS if ratio > 1.0 else Image.Resampling.BOX)
+    start = _step(report, 'resize', start)
+
+    # Pad the numpy array instead of making a padded copy of the full-size page
+    border = max(1, int(round(border * ratio)))
+    padded = cv2.copyMakeBorder(np.asarray(gray), border, border, border, border, cv2.BORDER_CONSTANT, value=255)
+    _step(report, 'pad', start)
+    return padded
+
+def preprocess_image(image, x_height=None, report=None):
     """Advanced image preprocessing for OCR, optimized for non-code images."""
     try:
-        # Convert to RGB if not already
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-
-        # Add minimal padding to avoid cropping text near edges
-        image = ImageOps.expand(image, border=10, fill='white')
-
-        # Preserve aspect ratio with a maximum size
-        original_size = image.size
-        max_size = 4000 if for_tesseract else 384
-        ratio = min(max_size / original_size[0], max_size / original_size[1])
-        new_size = (int(original_size[0] * ratio), int(original_size[1] * ratio))
-        image = image.resize(new_size, Image.Resampling.LANCZOS)
-
-        # Convert to NumPy array for OpenCV processing
-        image_np = np.array(image)
-        gray = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
+        # Scale by text size, not page size (see TARGET_X_HEIGHT)
+        ratio = text_scale(x_height, TARGET_X_HEIGHT['tesseract'], image.size)
+        if report is not None:
+            report['scale'] = ratio
+        gray = scaled_gray(image, ratio, report)
+        start = time.perf_counter()
 
         # Use adaptive thresholding for better handling of varying lighting
         thresh = cv2.adaptiveThreshold(
             gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
         )
+        start = _step(report, 'threshold', start)
 
         # Denoise using bilateral filter to preserve edges
         denoised = cv2.bilateralFilter(thresh, 9, 75, 75)
+        start = _step(report, 'denoise', start)
 
         # Sharpen image
         sharp_kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
         sharpened = cv2.filter2D(denoised, -1, sharp_kernel)
+        start = _step(report, 'sharpen', start)
+
+        # Increase contrast (same as ImageEnhance.Contrast(1.5), as a lookup table in place)
+        mean = int(sharpened.mean() + 0.5)
+        lut = np.clip(mean + 1.5 * (np.arange(256) - mean), 0, 255).astype(np.uint8)
+        cv2.LUT(sharpened, lut, dst=sharpened)
 
         # Convert back to PIL Image
         processed_image = Image.fromarray(sharpened)
+        _step(report, 'contrast', start)
 
-        # Increase contrast if needed
-        enhancer = ImageEnhance.Contrast(processed_image)
-        processed_image = enhancer.enhance(1.5)
-
-        logger.info(f"Image preprocessed: size={processed_image.size}")
+        logger.info(f"Image preprocessed: size={processed_image.size}, scale={ratio}")
         return processed_image
 
     except Exception as e:
         logger.error(f"Image preprocessing failed: {str(e)}")
         return image  # Return original image if preprocessing fails
 
-def preprocess_image_for_code(image):
+def preprocess_image_for_code(image, x_height=None, report=None):
     """Minimal preprocessing for code images to preserve details."""
     try:
-        # Convert to RGB if not already
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-
-        # Add minimal padding to avoid cropping text near edges
-        image = ImageOps.expand(image, border=10, fill='white')
-
-        # Increase resolution for better character recognition
-        original_size = image.size
-        max_size = 4000  # Higher resolution for code images
-        ratio = min(max_size / original_size[0], max_size / original_size[1])
-        new_size = (int(original_size[0] * ratio), int(original_size[1] * ratio))
-        image = image.resize(new_size, Image.Resampling.LANCZOS)
-
-        # Convert to NumPy array for OpenCV processing
-        image_np = np.array(image)
-        gray = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
+        # Screenshots usually have small text, bring it up to a size Tesseract likes
+        ratio = text_scale(x_height, TARGET_X_HEIGHT['code'], image.size)
+        if report is not None:
+            report['scale'] = ratio
+        gray = scaled_gray(image, ratio, report)
+        start = time.perf_counter()
 
         # Use simple thresholding to preserve character details
         thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+        _step(report, 'threshold', start)
 
         # Convert back to PIL Image
         processed_image = Image.fromarray(thresh)
 
-        logger.info(f"Code image preprocessed: size={processed_image.size}")
+        logger.info(f"Code image preprocessed: size={processed_image.size}, scale={ratio}")
         return processed_image
 
     except Exception as e:
         logger.error(f"Code image preprocessing failed: {str(e)}")
         return image
 
+def find_text_lines(image, max_side=1600):
+    """Find text lines with a horizontal projection profile.
+    Returns (left, top, right, bottom) boxes in image coordinates, top to bottom."""
+    try:
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        # The profile doesn't need full resolution
+        scale = min(1.0, max_side / max(image.size))
+        if scale < 1.0:
+            small = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.Resampling.BILINEAR)
+        else:
+            small = image
+        gray = cv2.cvtColor(np.array(small), cv2.COLOR_RGB2GRAY)
+        binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+        # Light text on a dark background: flip so text pixels are always the "on" ones
+        if np.count_nonzero(binary) > binary.size / 2:
+            binary = cv2.bitwise_not(binary)
+
+        # A row belongs to a line when it has more than a few speckles of ink
+        height, width = binary.shape
+        ink_rows = np.count_nonzero(binary, axis=1) > max(1, width // 500)
+
+        boxes = []
+        y = 0
+        while y < height:
+            if not ink_rows[y]:
+                y += 1
+                continue
+            top = y
+            while y < height and ink_rows[y]:
+                y += 1
+            if y - top < 3:  # Too thin to be text
+                continue
+            columns = np.flatnonzero(binary[top:y].any(axis=0))
+            left, right = columns[0], columns[-1] + 1
+            pad = 2
+            boxes.append((
+                int(max(left - pad, 0) / scale), int(max(top - pad, 0) / scale),
+                int(min(right + pad, width) / scale), int(min(y + pad, height) / scale)
+            ))
+        return boxes
+    except Exception as e:
+        logger.error(f"Line detection failed: {str(e)}")
+        return []
+
+def reading_order(boxes):
+    """Sort (left, top, right, bottom) boxes into rows top to bottom, left to right in a row.
+    Boxes side by side (e.g. two columns) share a row, so columns are read one after another."""
+    rows = []
+    for box in sorted(boxes, key=lambda b: b[1]):
+        for row in rows:
+            top, bottom = row['top'], row['bottom']
+            overlap = min(bottom, box[3]) - max(top, box[1])
+            if overlap > 0.5 * min(bottom - top, box[3] - box[1]):
+                row['boxes'].append(box)
+                row['top'], row['bottom'] = min(top, box[1]), max(bottom, box[3])
+                break
+        else:
+            rows.append({'top': box[1], 'bottom': box[3], 'boxes': [box]})
+    return [box for row in rows for box in sorted(row['boxes'], key=lambda b: b[0])]
+
+def _line_bands(binary, box):
+    """(top, bottom) of every run of rows with ink inside an (x, y, w, h) box."""
+    x, y, w, h = box
+    rows = binary[y:y + h, x:x + w].any(axis=1)
+    bands = []
+    top = None
+    for i, ink in enumerate(np.append(rows, False)):
+        if ink and top is None:
+            top = i
+        elif not ink and top is not None:
+            bands.append((y + top, y + i))
+            top = None
+    return bands
+
+def _share_lines(a, b):
+    """True when most text lines of one region continue in the other, like a receipt's
+    items and prices, or a form's labels and values."""
+    fewer, more = sorted((a, b), key=len)
+    if not fewer:
+        return False
+    shared = sum(
+        1 for top, bottom in fewer
+        if any(min(bottom, other_bottom) - max(top, other_top) > 0.5 * min(bottom - top, other_bottom - other_top)
+               for other_top, other_bottom in more)
+    )
+    return shared >= 0.6 * len(fewer)
+
+def merge_side_by_side(binary, boxes):
+    """Merge (x, y, w, h) boxes next to each other whose text lines line up. Read apart,
+    all of the items would come before all of the prices. Read together, each line stays
+    whole. Two real columns get merged too, which is just how the page is read without
+    regions."""
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                (ax, ay, aw, ah), (bx, by, bw, bh) = boxes[i], boxes[j]
+                if min(ay + ah, by + bh) <= max(ay, by):
+                    continue  # Not next to each other
+                if _share_lines(_line_bands(binary, boxes[i]), _line_bands(binary, boxes[j])):
+                    left, top = min(ax, bx), min(ay, by)
+                    boxes[i] = (left, top, max(ax + aw, bx + bw) - left, max(ay + ah, by + bh) - top)
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+def find_text_regions(thumbnail, size, x_height=None):
+    """Text blocks found with a morphology pass on the thumbnail.
+    Returns (left, top, right, bottom) boxes in full-size coordinates, in reading order."""
+    try:
+        scale = thumbnail.width / size[0]
+        gray = cv2.cvtColor(np.array(thumbnail), cv2.COLOR_RGB2GRAY)
+        # Letters have strong local contrast whatever the background colour
+        gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+        binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+        # Smear letters into words, words into lines and lines into blocks
+        letter = max(2.0, (x_height or 0) * scale) if x_height else max(2.0, thumbnail.height / 150)
+        # Gaps wider than this (a receipt's item and price, table columns) are joined
+        # afterwards by merge_side_by_side, when the lines on both sides line up
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, int(letter * 5)), max(3, int(letter * 1.5))))
+        blocks = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+        contours = cv2.findContours(blocks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+
+        found = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if h < letter * 0.8 or w < letter * 2:
+                continue  # Specks and lone rules
+            # The border of a box or a filled shape only has edges around the outside. Text
+            # has them inside too, even a sparse column of right-aligned prices.
+            inset = int(letter)
+            inside = blocks[y + inset:y + h - inset, x + inset:x + w - inset]
+            if inside.size and np.count_nonzero(inside) < 0.1 * inside.size:
+                continue
+            edges = np.count_nonzero(binary[y:y + h, x:x + w]) / float(w * h)
+            if edges > 0.6 and w * h > blocks.size * 0.05:
+                continue  # Solid texture, more likely a photo than text
+            found.append((x, y, w, h))
+
+        boxes = []
+        pad = int(letter)
+        for x, y, w, h in merge_side_by_side(binary, found):
+            boxes.append((
+                int(max(x - pad, 0) / scale), int(max(y - pad, 0) / scale),
+                int(min(x + w + pad, thumbnail.width) / scale), int(min(y + h + pad, thumbnail.height) / scale)
+            ))
+        return reading_order(boxes)
+    except Exception as e:
+        logger.error(f"Text region detection failed: {str(e)}")
+        return []
+
+def crop_regions(page):
+    """The page's text regions as PreparedPages, or [] when the page is read as a whole."""
+    # Don't even look for regions when they're turned off
+    if not TEXT_REGIONS:
+        return []
+    boxes = page.variant('regions')
+    if not boxes or len(boxes) > MAX_TEXT_REGIONS:
+        return []
+    area = sum((right - left) * (bottom - top) for left, top, right, bottom in boxes)
+    if area > REGION_MAX_COVERAGE * page.image.width * page.image.height:
+        return []
+    # Crops share the page's text size, they are too small to estimate it on their own
+    x_height = page.variant('x_height')
+    return [PreparedPage(page.image.crop(box), {'x_height': x_height, 'regions': []}) for box in boxes]
+
+# Every engine used to preprocess the page on its own, so the same 4000px resize,
+# threshold and filters ran three times per page. A PreparedPage computes each
+# variant the first time someone asks for it and hands the same result to everyone after.
+# Each preprocessor gets the PreparedPage, so it can build on other variants.
+PREPROCESSORS = {
+    'tesseract': lambda page: preprocess_image(page.image, page.variant('x_height'), page.report('tesseract')),  # Tesseract, EasyOCR
+    'lines': lambda page: find_text_lines(page.image),  # Line boxes for TrOCR
+    'thumbnail': lambda page: make_thumbnail(page.image),  # Code detection, text size
+    'x_height': lambda page: estimate_x_height(page.variant('thumbnail'), page.image.width),
+    'code': lambda page: preprocess_image_for_code(page.image, page.variant('x_height'), page.report('code')),
+    'regions': lambda page: find_text_regions(page.variant('thumbnail'), page.image.size, page.variant('x_height')),
+    'region_pages': crop_regions,
+}
+
+class PreparedPage:
+    """A page image plus its preprocessed variants, each computed at most once."""
+
+    def __init__(self, image, variants=None):
+        self.image = image
+        self._variants = dict(variants or {})
+        self._lock = threading.Lock()
+        self._variant_locks = {}
+        # Milliseconds per variant, plus scale and step timings where a preprocessor reports them
+        self._reports = {}
+
+    def report(self, name):
+        with self._lock:
+            return self._reports.setdefault(name, {})
+
+    def regions(self):
+        """Pages the engines should read: the text regions in reading order, or just this page."""
+        return self.variant('region_pages') or [self]
+
+    def preprocess_info(self):
+        """What preprocessing did to this page: text size, scale factors and timings."""
+        x_height = self._variants.get('x_height')
+        with self._lock:
+            variants = {name: dict(report) for name, report in self._reports.items()}
+        return {
+            'decode_ms': self.image.info.get('decode_ms'),
+            'decode_scale': self.image.info.get('decode_scale', 1.0),
+            'x_height': round(x_height, 1) if x_height else None,
+            'variants': variants,
+        }
+
+    def variant(self, name):
+        """Return the preprocessed variant, computing it only if nobody has asked for it yet."""
+        # One lock per variant, so engines running in parallel wait for the variant they
+        # share but not for each other's
+        with self._lock:
+            lock = self._variant_locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._variants:
+                start = time.perf_counter()
+                self._variants[name] = PREPROCESSORS[name](self)
+                elapsed = time.perf_counter() - start
+                self.report(name)['ms'] = round(elapsed * 1000, 2)
+                # Variants built on other variants include their time, like in the report
+                record('preprocess', elapsed, start, variant=name)
+            return self._variants[name]
+
+def as_page(image):
+    """Wrap a plain PIL image in a PreparedPage (pages pass through untouched)."""
+    return image if isinstance(image, PreparedPage) else PreparedPage(image)
+
 def post_process_text(text):
     """Improved text post-processing for non-code text with minimal intervention."""
     try:
@@ -199,43 +682,79 @@ def post_process_code(text):
         logger.error(f"Code post-processing failed: {str(e)}")
         return text
 
+# Map language codes to Tesseract language codes
+TESSERACT_LANG_MAP = {
+    'en': 'eng',
+    'fr': 'fra',
+    'de': 'deu',
+    'hi': 'hin'
+}
+
+def for_each_region(ocr):
+    """Run a page-level OCR function on every text region of the page and join the texts."""
+    @functools.wraps(ocr)
+    def run(image, *args, **kwargs):
+        texts = [ocr(region, *args, **kwargs) for region in as_page(image).regions()]
+        return ' '.join(text for text in texts if text)
+    return run
+
+@for_each_region
 def ocr_with_tesseract(image, lang='en'):
     """OCR using Tesseract with optimized settings."""
     try:
-        # Preprocess for Tesseract
-        image = preprocess_image(image, for_tesseract=True)
-
-        # Map language codes to Tesseract language codes
-        tesseract_lang_map = {
-            'en': 'eng',
-            'fr': 'fra',
-            'de': 'deu',
-            'hi': 'hin'
-        }
-        tesseract_lang = tesseract_lang_map.get(lang, 'eng')
+        # Preprocess for Tesseract (shared with the other engines)
+        image = as_page(image).variant('tesseract')
+
+        tesseract_lang = TESSERACT_LANG_MAP.get(lang, 'eng')
 
-        # Tesseract configuration
-        config = f"--psm 6 --oem 3 -l {tesseract_lang}"
-        text = pytesseract.image_to_string(image, config=config)
+        # Block of text (psm 6), through the resident engine pool when tesserocr is installed
+        text = recognize(image, tesseract_lang, psm=6)['text']
 
         # Post-process the text
         text = post_process_text(text)
 
-        logger.info(f"Tesseract extracted text (lang={tesseract_lang}): {text[:100]}...")
+        if LOG_TEXT:
+            logger.info(f"Tesseract extracted text (lang={tesseract_lang}): {text[:100]}...")
         return text
     except Exception as e:
         logger.error(f"Tesseract OCR failed: {str(e)}")
+        metrics.inc('ocr_engine_errors_total', engine='tesseract')
         return ""
 
+def ocr_with_tesseract_data(image, lang='en'):
+    """Tesseract through image_to_data, so we also get a confidence for every word."""
+    try:
+        tesseract_lang = TESSERACT_LANG_MAP.get(lang, 'eng')
+        texts, words = [], []
+        for number, region in enumerate(as_page(image).regions()):
+            result = recognize(region.variant('tesseract'), tesseract_lang, psm=6, words=True)
+            texts.append(result['text'])
+            # Word boxes are relative to the preprocessed region they were found in
+            words += [dict(word, region=number) for word in result['words']]
+        confidences = [word['conf'] for word in words]
+
+        text = post_process_text('\n'.join(texts))
+        confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        # Coverage: share of words Tesseract is reasonably sure about
+        coverage = (sum(1 for c in confidences if c >= CASCADE_WORD_CONFIDENCE) / len(confidences)) if confidences else 0.0
+
+        logger.info(f"Tesseract data (lang={tesseract_lang}): {len(confidences)} words, mean confidence {confidence:.1f}, coverage {coverage:.2f}")
+        return {'text': text, 'confidence': confidence, 'coverage': coverage, 'words': len(confidences), 'word_boxes': words}
+    except Exception as e:
+        logger.error(f"Tesseract OCR failed: {str(e)}")
+        metrics.inc('ocr_engine_errors_total', engine='tesseract')
+        return {'text': "", 'confidence': 0.0, 'coverage': 0.0, 'words': 0, 'word_boxes': []}
+
+@for_each_region
 def ocr_with_easyocr(image, lang='en'):
     """OCR using EasyOCR for multi-language support."""
     try:
-        # Preprocess for EasyOCR
-        image = preprocess_image(image, for_tesseract=True)
+        # Preprocess for EasyOCR (same variant Tesseract uses)
+        image = as_page(image).variant('tesseract')
         image_np = np.array(image)
 
         # Choose appropriate reader
-        reader = devanagari_reader if lang == 'hi' else latin_reader
+        reader = easyocr_reader(lang)
 
         # Extract text with improved parameters
         result = reader.readtext(
@@ -250,52 +769,101 @@ def ocr_with_easyocr(image, lang='en'):
         text = ' '.join(result) if result else ""
         text = post_process_text(text)
 
-        logger.info(f"EasyOCR extracted text: {text[:100]}...")
+        if LOG_TEXT:
+            logger.info(f"EasyOCR extracted text: {text[:100]}...")
         return text
     except Exception as e:
         logger.error(f"EasyOCR failed: {str(e)}")
+        metrics.inc('ocr_engine_errors_total', engine='easyocr')
         return ""
 
+_trocr_stats = {'lines': 0, 'batches': 0, 'seconds': 0.0}
+_trocr_stats_lock = threading.Lock()
+
+def trocr_stats():
+    """How fast TrOCR has been decoding lines so far (to tune OCR_TROCR_BATCH_SIZE)."""
+    with _trocr_stats_lock:
+        stats = dict(_trocr_stats)
+    stats['lines_per_second'] = round(stats['lines'] / stats['seconds'], 2) if stats['seconds'] else 0.0
+    stats['batch_size'] = TROCR_BATCH_SIZE
+    return stats
+
+def trocr_decode(processor, model, crops):
+    """Decode line crops in one generate call. The processor resizes every crop to the
+    same input size, so a batch is a single tensor."""
+    pixel_values = processor(images=crops, return_tensors="pt").pixel_values
+    generated_ids = model.generate(pixel_values, max_length=TROCR_MAX_LINE_LENGTH)
+    return processor.batch_decode(generated_ids, skip_special_tokens=True)
+
+def _run_trocr_batch(key, crops):
+    """Decode one batch of line crops for the scheduler."""
+    processor, model = registry.get('trocr')
+    start = time.perf_counter()
+    lines = trocr_decode(processor, model, crops)
+    elapsed = time.perf_counter() - start
+
+    with _trocr_stats_lock:
+        _trocr_stats['lines'] += len(crops)
+        _trocr_stats['batches'] += 1
+        _trocr_stats['seconds'] += elapsed
+    return lines
+
+register_backend_model(
+    'trocr', TROCR_MODEL, _load_trocr_fp32, 'ORTModelForVision2Seq',
+    lambda model, texts: trocr_decode(_trocr_processor(), model, [render_text_line(text) for text in texts]),
+    has_reference=True
+)
+
+# Line crops from all pages and requests in flight are batched together (see scheduler.py)
+_trocr_scheduler = BatchScheduler('trocr', _run_trocr_batch, TROCR_BATCH_SIZE)
+
 def ocr_with_trocr(image):
-    """OCR using TrOCR for printed text."""
+    """OCR using TrOCR for printed text, one batch of text lines at a time."""
     try:
-        # Preprocess for TrOCR
-        image = preprocess_image(image, for_tesseract=False)
-
-        # Prepare image for model
-        pixel_values = processor(images=image, return_tensors="pt").pixel_values
-
-        # Generate text
-        generated_ids = model.generate(pixel_values, max_length=512)
-        text = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        # TrOCR is a single-line model, so feed it line crops rather than the whole page
+        # Lines of all text regions go to the scheduler together, in reading order
+        crops = []
+        for region in as_page(image).regions():
+            crops += [region.image.crop(box).convert('RGB') for box in region.variant('lines')]
+        if not crops:
+            logger.info("TrOCR found no text lines")
+            return ""
+
+        start = time.perf_counter()
+        lines = _trocr_scheduler.run(crops)
+        elapsed = time.perf_counter() - start
+        logger.info(f"TrOCR decoded {len(crops)} lines in {elapsed:.2f}s ({len(crops) / elapsed:.1f} lines/s, batch size {TROCR_BATCH_SIZE})")
 
         # Post-process the text
-        text = post_process_text(text)
+        text = post_process_text('\n'.join(lines))
 
-        logger.info(f"TrOCR extracted text: {text[:100]}...")
+        if LOG_TEXT:
+            logger.info(f"TrOCR extracted text: {text[:100]}...")
         return text
     except Exception as e:
         logger.error(f"TrOCR OCR failed: {str(e)}")
+        metrics.inc('ocr_engine_errors_total', engine='trocr')
         return ""
 
 def ocr_for_code(image):
     """OCR pipeline specifically for code images."""
     try:
         # Preprocess minimally for code
-        image = preprocess_image_for_code(image)
+        image = as_page(image).variant('code')
 
         # Use Tesseract with a configuration optimized for code
         # Try --psm 1 (single block of text) to better handle full lines
-        config = "--psm 1 --oem 3 -l eng"
-        text = pytesseract.image_to_string(image, config=config)
+        text = recognize(image, 'eng', psm=1)['text']
 
         # Post-process minimally to preserve code formatting
         text = post_process_code(text)
 
-        logger.info(f"Code OCR extracted text: {text[:100]}...")
+        if LOG_TEXT:
+            logger.info(f"Code OCR extracted text: {text[:100]}...")
         return text
     except Exception as e:
         logger.error(f"Code OCR failed: {str(e)}")
+        metrics.inc('ocr_engine_errors_total', engine='code')
         return ""
 
 def merge_ocr_results(results):
@@ -314,77 +882,309 @@ def merge_ocr_results(results):
     # Prefer longer, more meaningful results
     merged_text = max(valid_results, key=lambda x: len(x.split()))
 
-    logger.info(f"Merged OCR result: {merged_text[:100]}...")
+    if LOG_TEXT:
+        logger.info(f"Merged OCR result: {merged_text[:100]}...")
     return merged_text
 
+# Engines for non-code pages. The order matters: merge_ocr_results keeps the first
+# of two equally long results.
+register_engine('tesseract', ocr_with_tesseract, 'subprocess')
+register_engine('easyocr', ocr_with_easyocr, 'torch')
+register_engine('trocr', lambda image, lang='en': ocr_with_trocr(image), 'batched')
+NON_CODE_ENGINES = ['tesseract', 'easyocr', 'trocr']
+
+def ocr_non_code_page(image, lang='en', mode=None):
+    """OCR a non-code page with every engine ('all') or with the cheap-first cascade."""
+    mode = mode or OCR_MODE
+    info = {'type': 'text', 'mode': mode}
+    # Text regions the engines read, as [left, top, right, bottom] (empty when the page is read as a whole)
+    image = as_page(image)
+    # region_pages is [] without finding regions when OCR_TEXT_REGIONS is off
+    info['regions'] = [list(box) for box in image.variant('regions')] if image.variant('region_pages') else []
+
+    if mode == 'cascade':
+        # Tier 1: Tesseract alone, accepted when it is confident about most words
+        with stage('engine', engine='tesseract'):
+            tesseract = ocr_with_tesseract_data(image, lang)
+        count_engine_call('tesseract', tesseract['text'])
+        info.update(confidence=round(tesseract['confidence'], 1), coverage=round(tesseract['coverage'], 3))
+        if (tesseract['words'] and tesseract['confidence'] >= CASCADE_MIN_CONFIDENCE
+                and tesseract['coverage'] >= CASCADE_MIN_COVERAGE):
+            info.update(tier=1, engines=['tesseract'], text=tesseract['text'])
+            metrics.inc('ocr_cascade_tier_total', tier='1')
+            return info
+
+        # Tier 2: bring in the torch engines and merge like the 'all' mode does
+        results, problems = run_engines_detailed(['easyocr', 'trocr'], image, lang)
+        engine_results = [tesseract['text']] + results
+        info.update(tier=2, engines=NON_CODE_ENGINES)
+        metrics.inc('ocr_cascade_tier_total', tier='2')
+    else:
+        # Multiple OCR methods for non-code images, run side by side (see executor.py)
+        engine_results, problems = run_engines_detailed(NON_CODE_ENGINES, image, lang)
+        info.update(engines=NON_CODE_ENGINES)
+
+    # Engines that timed out or failed on this page, e.g. {'easyocr': 'timeout'}
+    if problems:
+        info['engine_failures'] = problems
+
+    # Keep every method that found something, in the same order as before
+    image_results = []
+    for result in engine_results:
+        if result:
+            image_results.append(result)
+            if LOG_TEXT:
+                logger.info(f"OCR method result: {result[:50]}...")
+
+    # Merge results for this image
+    with stage('merge'):
+        info['text'] = merge_ocr_results(image_results) if image_results else ""
+    return info
+
+def ocr_page(image, lang='en', mode=None):
+    """OCR a single page and describe how the text was produced."""
+    # Preprocessed variants are computed once per page and shared by every step below
+    image = as_page(image)
+
+    # Detect if the image contains code
+    is_code, code_confidence = detect_code(image)
+    if is_code:
+        logger.info("Detected code in image")
+        with stage('engine', engine='code'):
+            text = ocr_for_code(image)
+        count_engine_call('code', text)
+        page = {'type': 'code', 'engines': ['tesseract'], 'text': text}
+    else:
+        logger.info("Processing as non-code image")
+        page = ocr_non_code_page(image, lang, mode)
+    page['code_confidence'] = round(code_confidence, 3)
+    page['preprocess'] = image.preprocess_info()
+    return page
+
+def extract_pdf_text_layer(pdf_path):
+    """Embedded text of every PDF page via poppler's pdftotext ('' for pages without any)."""
+    try:
+        completed = subprocess.run(
+            ['pdftotext', '-layout', '-enc', 'UTF-8', pdf_path, '-'],
+            capture_output=True, timeout=120, check=True
+        )
+        # pdftotext ends every page with a form feed
+        return completed.stdout.decode('utf-8', errors='replace').split('\f')
+    except Exception as e:
+        logger.warning(f"PDF text extraction failed: {str(e)}, falling back to OCR")
+        return []
+
+def has_usable_text(text):
+    return sum(c.isalnum() for c in text) >= PDF_TEXT_MIN_CHARS
+
+def iter_pdf_pages(pdf, page_count, dpi=None, batch=None):
+    """Yield (page number, source) for a PDF, where source is the embedded text of the
+    page or, for pages without usable text, the page rendered as an image.
+
+    Pages that need rendering are rendered lazily, a small range at a time.
+    """
+    dpi = dpi or PDF_DPI
+    batch = max(1, batch or PDF_PAGE_BATCH)
+    try:
+        with stage('pdf_text_layer'):
+            text_layer = extract_pdf_text_layer(pdf.name) if PDF_TEXT_LAYER else []
+        number = 1
+        while number <= page_count:
+            page_text = text_layer[number - 1] if number <= len(text_layer) else ''
+            if has_usable_text(page_text):
+                yield number, page_text
+                number += 1
+                continue
+
+            # Render the next run of pages that have no usable text, up to batch pages
+            last = number
+            while (last + 1 <= page_count and last + 1 - number < batch
+                   and not has_usable_text(text_layer[last] if last < len(text_layer) else '')):
+                last += 1
+            start = time.perf_counter()
+            images = convert_from_path(pdf.name, dpi=dpi, first_page=number, last_page=last)
+            record('pdf_rasterize', time.perf_counter() - start, start)
+            render_ms = round((time.perf_counter() - start) * 1000 / max(len(images), 1), 2)
+            for offset, image in enumerate(images):
+                image.info['decode_ms'] = render_ms
+                yield number + offset, image
+            number = last + 1
+    finally:
+        pdf.close()
+
+def load_image(source):
+    """Decode an uploaded image (bytes or a file object) to RGB, keeping as few full-size
+    copies as possible. Decode time and scale are left in image.info."""
+    start = time.perf_counter()
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    image = Image.open(source)  # Only reads the header
+    width, height = image.size
+    if image.format == 'JPEG' and max(width, height) > MAX_DECODE_SIDE:
+        # draft() makes libjpeg decode at the smallest 1/2^n scale that is still this big
+        factor = MAX_DECODE_SIDE / max(width, height)
+        image.draft('RGB', (int(width * factor), int(height * factor)))
+    # The limit applies to what we actually decode, so big JPEGs are fine after draft()
+    if image.width * image.height > MAX_IMAGE_PIXELS:
+        raise ValueError(f"Image is too large ({image.width}x{image.height} pixels, the limit is {MAX_IMAGE_PIXELS})")
+    # convert() always copies, so only call it when the mode actually differs
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.load()
+
+    record('decode', time.perf_counter() - start, start)
+    image.info['decode_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    image.info['decode_scale'] = round(image.width / width, 4)
+    logger.info(f"Decoded {width}x{height} image at {image.width}x{image.height} in {image.info['decode_ms']}ms")
+    return image
+
+def spool_upload(file):
+    """Copy an upload into a temp file we own (small ones stay in memory), chunk by chunk."""
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    shutil.copyfileobj(file.stream, spooled, 1024 * 1024)
+    spooled.seek(0)
+    return spooled
+
+def open_pages(source, mimetype, dpi=None):
+    """Return (page count, iterator over (page number, source)) for an uploaded file.
+
+    The upload can be bytes or a file object (e.g. the upload stream, which Flask spools
+    to a temp file when it's big), so it never has to be read into memory in one piece.
+    A page source is a page image, or the page's text when a PDF already carries a text layer.
+    """
+    # Handle different file types
+    if mimetype and mimetype.startswith('image'):
+        return 1, iter([(1, load_image(source))])
+    elif mimetype == 'application/pdf':
+        # Write the PDF once and let poppler read the page ranges from disk
+        pdf = tempfile.NamedTemporaryFile(suffix='.pdf')
+        if isinstance(source, (bytes, bytearray)):
+            pdf.write(source)
+        else:
+            shutil.copyfileobj(source, pdf, 1024 * 1024)
+        pdf.flush()
+        page_count = pdfinfo_from_path(pdf.name)['Pages']
+        return page_count, iter_pdf_pages(pdf, page_count, dpi)
+    else:
+        try:
+            image = load_image(source)
+            logger.info("Successfully opened file as image")
+            return 1, iter([(1, image)])
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to open file: {str(e)}")
+            raise ValueError("Unable to process file")
+
+def ocr_settings_key(lang='en', mode=None):
+    """Everything besides the pixels that changes what OCR returns for a page.
+    Bump the version whenever preprocessing or merging changes."""
+    return (f"v8|{lang}|{mode or OCR_MODE}|{CODE_DETECTOR}|{CODE_THRESHOLD}|{tesseract_backend()}|{','.join(NON_CODE_ENGINES)}|"
+            f"{TROCR_MODEL}|{MODEL_BACKEND}|{TROCR_MAX_LINE_LENGTH}|"
+            f"{CASCADE_MIN_CONFIDENCE}|{CASCADE_MIN_COVERAGE}|{CASCADE_WORD_CONFIDENCE}|"
+            f"{TARGET_X_HEIGHT['tesseract']}|{TARGET_X_HEIGHT['code']}|{MIN_X_HEIGHT}|"
+            f"{TEXT_REGIONS}|{REGION_MAX_COVERAGE}|{MAX_TEXT_REGIONS}")
+
+def ocr_page_cached(image, lang='en', mode=None):
+    """ocr_page, but pages we've already seen come straight from the cache (see cache.py)."""
+    if not ocr_cache.enabled:
+        return ocr_page(image, lang, mode)
+
+    key = image_key(image, ocr_settings_key(lang, mode))
+    cached = ocr_cache.get(key)
+    if cached is not None:
+        page = dict(cached)
+        page['cached'] = True
+        return page
+
+    page = ocr_page(image, lang, mode)
+    # Empty pages aren't cached, they may just be an engine that failed this time,
+    # and neither are pages where an engine timed out or failed
+    if page['text'] and not page.get('engine_failures'):
+        # Timings describe this run only, a cache hit didn't preprocess anything
+        ocr_cache.put(key, {k: v for k, v in page.items() if k != 'preprocess'})
+    return page
+
+def ocr_source(number, source, page_count, lang='en', mode=None):
+    """One (page number, source) from open_pages turned into a processed page."""
+    if isinstance(source, str):
+        # Text layer of a born-digital PDF, no OCR needed
+        page = {'type': 'text', 'source': 'text_layer', 'engines': [], 'text': post_process_text(source)}
+    else:
+        page = ocr_page_cached(source, lang, mode)
+        page['source'] = 'ocr'
+    page['page'] = number
+    page['page_count'] = page_count
+    metrics.inc('ocr_pages_total', type=page['type'], source='cache' if page.get('cached') else page['source'])
+    return page
+
+def iter_ocr_pages(pages, page_count, lang='en', mode=None):
+    """OCR pages one at a time, yielding each page as soon as it's done."""
+    for number, source in pages:
+        yield ocr_source(number, source, page_count, lang, mode)
+
+def ocr_language(option, source_lang, target_lang):
+    """Language the OCR engines should use, the same way /process and translate_text pick it."""
+    if option == 'translate':
+        return source_lang if source_lang != 'auto' else 'en'
+    return target_lang if target_lang != 'en' else 'en'
+
+def page_result(page):
+    """The text a page contributes to the final result, or None if it adds nothing."""
+    # Code pages are always kept, text pages only when an engine found something
+    if page['type'] == 'code' or page['text']:
+        return page['text']
+    return None
+
 # The main function that decides how to process text and files.
-def ocr_process(text, file, lang='en'):
+def ocr_process(text, file, lang='en', mode=None, dpi=None):
     """Robust OCR processing with multiple fallback methods."""
+    return ocr_process_detailed(text, file, lang, mode, dpi)['result']
+
+def ocr_process_detailed(text, file, lang='en', mode=None, dpi=None, measure_memory=False):
+    """Same as ocr_process, but also returns what happened on every page, and the peak
+    memory of the request when measure_memory is set."""
     try:
         # If text is provided, return it as-is
         if text:
             logger.info("Processing provided text")
-            return text
+            return {'result': text, 'pages': []}
 
         # If a file is provided, process it
         if file:
             logger.info(f"Processing file with mimetype: {file.mimetype}")
-            file_content = file.read()
-            images = []
-            # Handle different file types
-            if file.mimetype and file.mimetype.startswith('image'):
-                images = [Image.open(io.BytesIO(file_content)).convert("RGB")]
-            elif file.mimetype == 'application/pdf':
-                images = convert_from_bytes(file_content)
-            else:
+            # Sampling RSS costs a thread per request, so only when someone asks for the number
+            memory = PeakRSS() if measure_memory else None
+            with memory or contextlib.nullcontext():
                 try:
-                    images = [Image.open(io.BytesIO(file_content)).convert("RGB")]
-                    logger.info("Successfully opened file as image")
-                except Exception as e:
-                    logger.error(f"Failed to open file: {str(e)}")
-                    return "Unable to process file"
-
-            # Process each image and collect results
-            results = []
-            for image in images:
-                # Detect if the image contains code
-                if is_code_image(image):
-                    logger.info("Detected code in image")
-                    result = ocr_for_code(image)
-                    results.append(result)
-                else:
-                    logger.info("Processing as non-code image")
-                    # Multiple OCR methods for non-code images
-                    ocr_methods = [
-                        lambda img: ocr_with_tesseract(img, lang),
-                        lambda img: ocr_with_easyocr(img, lang),
-                        lambda img: ocr_with_trocr(img)
-                    ]
-
-                    # Try each OCR method
-                    image_results = []
-                    for method in ocr_methods:
-                        try:
-                            result = method(image)
-                            if result:
-                                image_results.append(result)
-                                logger.info(f"OCR method result: {result[:50]}...")
-                        except Exception as e:
-                            logger.warning(f"OCR method failed: {str(e)}")
-
-                    # Merge results for this image
-                    if image_results:
-                        results.append(merge_ocr_results(image_results))
+                    # Read from the upload stream, not from a bytes copy of the whole file
+                    page_count, sources = open_pages(file.stream, file.mimetype, dpi)
+                except ValueError as e:
+                    return {'result': str(e), 'pages': []}
+
+                # Process each page and collect results. Pages are rendered lazily, so only
+                # the text of finished pages is kept around.
+                results = []
+                pages = []
+                for page in iter_ocr_pages(sources, page_count, lang, mode):
+                    pages.append(page)
+                    result = page_result(page)
+                    if result is not None:
+                        results.append(result)
 
             # Combine results from multiple images
             final_text = '\n'.join(results) if results else "No text extracted"
 
             logger.info(f"Final OCR result length: {len(final_text)}")
-            return final_text
+            processed = {'result': final_text, 'pages': pages}
+            if memory is not None:
+                logger.info(f"Peak RSS +{memory.stats()['peak_increase_bytes'] / 2**20:.0f} MiB")
+                processed['memory'] = memory.stats()
+            return processed
 
         logger.warning("No content to process")
-        return "No content to process"
+        return {'result': "No content to process", 'pages': []}
 
     except Exception as e:
         logger.error(f"OCR processing failed: {str(e)}")
-        return f"OCR processing error: {str(e)}"
\ No newline at end of file
+        return {'result': f"OCR processing error: {str(e)}", 'pages': []}
\ No newline at end of file
@@ -1,15 +1,73 @@
 # This file sets up the "roads" our app uses to handle requests.
 
-from flask import Blueprint, request, jsonify
-from .ocr import ocr_process
+from flask import Blueprint, Response, g, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from .ocr import ocr_process_detailed, open_pages, iter_ocr_pages, page_result, ocr_language, trocr_stats, easyocr_stats, spool_upload
 from .translate import translate_text
+from .models import registry
+from .cache import ocr_cache, translation_memory
+from .scheduler import scheduler_stats
+from .tesseract import tesseract_stats
+from .batch import iter_upload_members, process_batch, MAX_BATCH_BYTES
+from .jobs import store as job_store, submit_job, cancel_job, job_status, QueueFull, JOB_QUEUE_SIZE
+from .metrics import metrics, tracing, LOG_TEXT
+import json
 import logging
+import tarfile
+import time
+import zipfile
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 main = Blueprint('main', __name__)
 
+# Smallest and largest DPI we render PDF pages at
+MIN_DPI = 36
+MAX_DPI = 1200
+
+
+class InvalidParameter(ValueError):
+    """A form field has a value we can't use, answered with a 400."""
+
+
+@main.errorhandler(InvalidParameter)
+def invalid_parameter(e):
+    return jsonify({'error': str(e)}), 400
+
+
+def form_flag(form_data, name):
+    """An optional yes/no field ('1', 'true' or 'yes' mean yes)."""
+    return form_data.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def form_dpi(form_data):
+    """The optional dpi field as an int, or None when it isn't set."""
+    value = form_data.get('dpi')
+    if not value:
+        return None
+    try:
+        dpi = int(value)
+    except ValueError:
+        raise InvalidParameter(f"dpi must be a whole number, got {value!r}")
+    if not MIN_DPI <= dpi <= MAX_DPI:
+        raise InvalidParameter(f"dpi must be between {MIN_DPI} and {MAX_DPI}")
+    return dpi
+
+@main.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+# Request counts and latency per route. Streaming responses are counted when the
+# response starts, not when the last page has been sent.
+@main.after_request
+def count_request(response):
+    route = request.url_rule.rule if request.url_rule else 'unknown'
+    metrics.inc('ocr_requests_total', route=route, status=str(response.status_code))
+    if 'request_start' in g:
+        metrics.observe('ocr_request_seconds', time.perf_counter() - g.request_start, route=route)
+    return response
+
 # This is where the requests made from the frontend get processed.
 @main.route('/process', methods=['POST'])
 def process():
@@ -22,8 +80,16 @@ def process():
         option = form_data.get('option', 'ocr')
         source_lang = form_data.get('source_lang', 'auto')
         target_lang = form_data.get('target_lang', 'en')
+        # Optional: OCR mode ('all' or 'cascade') and per-page details in the response
+        mode = form_data.get('mode') or None
+        dpi = form_dpi(form_data)
+        # Optional: translation decoding profile ('greedy', 'small_beam' or 'beam')
+        profile = form_data.get('profile') or None
+        details = form_flag(form_data, 'details')
+        # Optional: timing of every stage of this request in the response
+        trace_requested = form_flag(form_data, 'trace')
 
-        logger.info(f"Options - Text: {text[:50]}, File: {file.filename if file else None}, Option: {option}, Source: {source_lang}, Target: {target_lang}")
+        logger.info(f"Options - Text: {text[:50] if LOG_TEXT else f'{len(text)} chars'}, File: {file.filename if file else None}, Option: {option}, Source: {source_lang}, Target: {target_lang}")
 
         # Validate inputs
         if not text and not file:
@@ -31,19 +97,233 @@ def process():
             return jsonify({'error': 'Please provide either text or a file'}), 400
 
         # Process based on the option
-        if option == 'ocr':
-            # Use source_lang for EasyOCR if needed
-            lang = target_lang if target_lang != 'en' else 'en'
-            result = ocr_process(text, file, lang=lang)
-        elif option == 'translate':
-            result = translate_text(text, file, source_lang, target_lang)
-        else:
+        if option not in ('ocr', 'translate'):
             logger.error("Invalid option provided")
             return jsonify({'error': 'Invalid option'}), 400
 
+        pages = None
+        with tracing(trace_requested) as trace:
+            if option == 'ocr':
+                # Use source_lang for EasyOCR if needed
+                lang = target_lang if target_lang != 'en' else 'en'
+                processed = ocr_process_detailed(text, file, lang=lang, mode=mode, dpi=dpi, measure_memory=details)
+                result = processed['result']
+                pages = processed['pages']
+            else:
+                result = translate_text(text, file, source_lang, target_lang, profile)
+
         logger.info(f"Processing successful, result length: {len(result)}")
-        return jsonify({'result': result})
+        response = {'result': result}
+        if details and pages is not None:
+            response['pages'] = pages
+            # Peak memory of this request (see PeakRSS in models.py)
+            response['memory'] = processed.get('memory')
+            # Which pages came straight from the PDF text layer and which were OCR'd
+            response['text_layer_pages'] = [p['page'] for p in pages if p.get('source') == 'text_layer']
+            response['ocr_pages'] = [p['page'] for p in pages if p.get('source') == 'ocr']
+        if trace is not None:
+            response['trace'] = trace.to_dict()
+        return jsonify(response)
 
+    except (RequestEntityTooLarge, InvalidParameter):
+        raise  # Answered with a 413 / 400 by the error handlers
     except Exception as e:
         logger.error(f"Process failed: {str(e)}")
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+# Same inputs as /process, but the file is OCR'd page by page and every page is sent back
+# as one line of JSON (NDJSON) as soon as it's done. Long PDFs are rendered a few pages at
+# a time, so memory stays flat and the client sees the first page right away.
+@main.route('/process/stream', methods=['POST'])
+def process_stream():
+    form_data = request.form
+    text = form_data.get('text', '')
+    file = request.files.get('file')
+    option = form_data.get('option', 'ocr')
+    source_lang = form_data.get('source_lang', 'auto')
+    target_lang = form_data.get('target_lang', 'en')
+    mode = form_data.get('mode') or None
+    dpi = form_dpi(form_data)
+    profile = form_data.get('profile') or None
+    trace_requested = form_flag(form_data, 'trace')
+
+    if not text and not file:
+        return jsonify({'error': 'Please provide either text or a file'}), 400
+    if option not in ('ocr', 'translate'):
+        return jsonify({'error': 'Invalid option'}), 400
+
+    # Same language choice as /process and translate_text
+    lang = ocr_language(option, source_lang, target_lang)
+    mimetype = file.mimetype if file else None
+    # Flask closes the upload when the request ends, before we're done streaming pages
+    upload = spool_upload(file) if file else None
+
+    def generate():
+        # The trace of the whole stream comes with the final line
+        with tracing(trace_requested) as trace:
+            yield from generate_lines(trace)
+
+    def done_line(result, trace):
+        done = {'done': True, 'result': result}
+        if trace is not None:
+            done['trace'] = trace.to_dict()
+        return json.dumps(done) + '\n'
+
+    def generate_lines(trace):
+        try:
+            if not upload:
+                result = text if option == 'ocr' else translate_text(text, None, source_lang, target_lang, profile)
+                yield done_line(result, trace)
+                return
+
+            page_count, sources = open_pages(upload, mimetype, dpi)
+            results = []
+            for page in iter_ocr_pages(sources, page_count, lang, mode):
+                result = page_result(page)
+                if option == 'translate' and result:
+                    result = page['translation'] = translate_text(result, None, source_lang, target_lang, profile)
+                if result is not None:
+                    results.append(result)
+                yield json.dumps(page) + '\n'
+
+            final_text = '\n'.join(results) if results else "No text extracted"
+            yield done_line(final_text, trace)
+        except Exception as e:
+            logger.error(f"Streaming process failed: {str(e)}")
+            yield json.dumps({'error': str(e)}) + '\n'
+        finally:
+            if upload:
+                upload.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Many files in one request: upload several 'files' (or 'file') fields and/or ZIP/TAR
+# archives. Every file is processed in parallel and gets its own result, timing or error.
+@main.route('/process/batch', methods=['POST'])
+def process_batch_route():
+    # A batch carries many files, so it gets its own limit instead of the single-file one
+    request.max_content_length = MAX_BATCH_BYTES
+    form_data = request.form
+    files = request.files.getlist('files') + request.files.getlist('file')
+    params = {
+        'option': form_data.get('option', 'ocr'),
+        'source_lang': form_data.get('source_lang', 'auto'),
+        'target_lang': form_data.get('target_lang', 'en'),
+        'mode': form_data.get('mode') or None,
+        'dpi': form_dpi(form_data),
+        'profile': form_data.get('profile') or None,
+        'details': form_flag(form_data, 'details'),
+    }
+    trace_requested = form_flag(form_data, 'trace')
+    if not files:
+        return jsonify({'error': 'Please provide one or more files'}), 400
+    if params['option'] not in ('ocr', 'translate'):
+        return jsonify({'error': 'Invalid option'}), 400
+
+    start = time.perf_counter()
+    try:
+        with tracing(trace_requested) as trace:
+            results = process_batch(iter_upload_members(files), params)
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        logger.error(f"Reading archive failed: {str(e)}")
+        return jsonify({'error': f'Unable to read archive: {str(e)}'}), 400
+
+    failed = sum(1 for entry in results if 'error' in entry)
+    logger.info(f"Batch processed: {len(results)} files, {failed} failed")
+    response = {
+        'files': results,
+        'count': len(results),
+        'failed': failed,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+    if trace is not None:
+        response['trace'] = trace.to_dict()
+    return jsonify(response)
+
+# Background jobs for long documents: submit returns a job id right away, then the
+# client polls the status (with page progress), fetches the result or cancels.
+@main.route('/jobs', methods=['POST'])
+def create_job():
+    form_data = request.form
+    file = request.files.get('file')
+    params = {
+        'text': form_data.get('text', ''),
+        'option': form_data.get('option', 'ocr'),
+        'source_lang': form_data.get('source_lang', 'auto'),
+        'target_lang': form_data.get('target_lang', 'en'),
+        'mode': form_data.get('mode') or None,
+        'dpi': form_dpi(form_data),
+        'profile': form_data.get('profile') or None,
+        'trace': form_flag(form_data, 'trace'),
+    }
+    if not params['text'] and not file:
+        return jsonify({'error': 'Please provide either text or a file'}), 400
+    if params['option'] not in ('ocr', 'translate'):
+        return jsonify({'error': 'Invalid option'}), 400
+
+    try:
+        job_id = submit_job(params, file)
+    except QueueFull as e:
+        # Backpressure: tell the client to come back instead of piling up work
+        logger.warning(str(e))
+        return jsonify({'error': str(e), 'queue_size': JOB_QUEUE_SIZE}), 503, {'Retry-After': '30'}
+
+    logger.info(f"Job {job_id} submitted")
+    return jsonify(job_status(job_store.get(job_id))), 202
+
+@main.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+@main.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Job is {job['status']}", **job_status(job)}), 409
+    return jsonify(json.loads(job['result']))
+
+@main.route('/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    job = cancel_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+# Shows which models are loaded, how long they took to load and roughly how much memory they use.
+@main.route('/models', methods=['GET'])
+def models():
+    return jsonify(registry.stats())
+
+
+# Prometheus metrics: stage latency histograms, engine, page and request counters,
+# model, cache and queue gauges.
+@main.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Hit/miss counters of the per-page OCR result cache.
+@main.route('/cache', methods=['GET'])
+def cache():
+    return jsonify(ocr_cache.stats())
+
+# Hit rate of the translation memory.
+@main.route('/cache/translations', methods=['GET'])
+def translation_cache():
+    return jsonify(translation_memory.stats())
+
+
+# Engine throughput, e.g. TrOCR lines per second for tuning OCR_TROCR_BATCH_SIZE,
+# plus queue depth and batch sizes of the model schedulers and the Tesseract engine pool.
+@main.route('/engines', methods=['GET'])
+def engines():
+    return jsonify({
+        'trocr': trocr_stats(),
+        'easyocr': easyocr_stats(),
+        'schedulers': scheduler_stats(),
+        'tesseract': tesseract_stats(),
+    })
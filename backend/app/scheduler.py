@@ -0,0 +1,149 @@
+'''
+This file lets concurrent requests share one forward pass of a torch model.
+Each model gets a queue. A worker thread waits a few milliseconds for requests to pile
+up, runs them through the model as one batch and hands every caller its own result,
+instead of every Flask thread calling model.generate with a batch of one.
+'''
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from .executor import torch_turn
+from .metrics import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How long the worker waits for more requests before running a batch
+BATCH_WINDOW_MS = float(os.environ.get('OCR_BATCH_WINDOW_MS', '10'))
+
+# Every scheduler, by name, for the stats endpoint
+schedulers = {}
+
+
+class BatchScheduler:
+    """Queue of items for one model, run in batches of up to max_batch items.
+
+    run_batch(key, items) must return one result per item. Only items submitted
+    with the same key (e.g. the same language pair) end up in the same batch.
+    """
+
+    def __init__(self, name, run_batch, max_batch=8, window_ms=BATCH_WINDOW_MS):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch = max(1, max_batch)
+        self.window = window_ms / 1000.0
+        self._queue = []
+        self._cond = threading.Condition()
+        self._worker = None
+        self._batch_sizes = Counter()
+        self._items = 0
+        self._max_depth = 0
+        self._busy_seconds = 0.0
+        schedulers[name] = self
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._loop, name=f'batch-{self.name}', daemon=True)
+            self._worker.start()
+
+    def submit(self, item, key=None):
+        """Queue one item and return a Future for its result."""
+        future = Future()
+        with self._cond:
+            self._ensure_worker()
+            self._queue.append((key, item, future))
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._cond.notify()
+        return future
+
+    def run(self, items, key=None):
+        """Queue several items and wait for all of their results, in order."""
+        futures = [self.submit(item, key) for item in items]
+        return [future.result() for future in futures]
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+
+            # Give other callers a short window to join this batch
+            deadline = time.monotonic() + self.window
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            key = self._queue[0][0]
+            batch, rest = [], []
+            for entry in self._queue:
+                if entry[0] == key and len(batch) < self.max_batch:
+                    batch.append(entry)
+                else:
+                    rest.append(entry)
+            self._queue = rest
+            return key, batch
+
+    def _loop(self):
+        while True:
+            key, batch = self._take_batch()
+            # Skip callers that gave up (cancelled) while waiting in the queue
+            batch = [(item, future) for _, item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+
+            # The model takes its turn on the torch threads (see executor.torch_turn)
+            with torch_turn:
+                start = time.perf_counter()
+                try:
+                    results = self.run_batch(key, items)
+                    for future, result in zip(futures, results):
+                        future.set_result(result)
+                except Exception as e:
+                    logger.error(f"Batch for {self.name} failed: {str(e)}")
+                    for future in futures:
+                        future.set_exception(e)
+                elapsed = time.perf_counter() - start
+
+            with self._cond:
+                self._batch_sizes[len(items)] += 1
+                self._items += len(items)
+                self._busy_seconds += elapsed
+
+    def stats(self):
+        """Queue depth, batch-size histogram and throughput."""
+        with self._cond:
+            batches = sum(self._batch_sizes.values())
+            return {
+                'queue_depth': len(self._queue),
+                'max_queue_depth': self._max_depth,
+                'batches': batches,
+                'items': self._items,
+                'mean_batch_size': round(self._items / batches, 2) if batches else 0.0,
+                'batch_size_histogram': {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                'items_per_second': round(self._items / self._busy_seconds, 2) if self._busy_seconds else 0.0,
+                'max_batch': self.max_batch,
+                'window_ms': self.window * 1000,
+            }
+
+
+def scheduler_stats():
+    return {name: scheduler.stats() for name, scheduler in schedulers.items()}
+
+
+def _scheduler_metrics():
+    """Queue depth and batch counters for /metrics."""
+    for name, stats in scheduler_stats().items():
+        labels = {'model': name}
+        yield 'ocr_batch_queue_depth', 'gauge', 'Items waiting for a batched model.', labels, stats['queue_depth']
+        yield 'ocr_batches_total', 'counter', 'Batches run by a batched model.', labels, stats['batches']
+        yield 'ocr_batch_items_total', 'counter', 'Items run by a batched model.', labels, stats['items']
+
+
+metrics.add_collector(_scheduler_metrics)
@@ -0,0 +1,94 @@
+'''
+This file is the production way of running the app: gunicorn with several worker
+processes (gunicorn.conf.py and wsgi.py in the backend folder), instead of the Flask
+development server in main.py.
+
+The models are loaded once in the gunicorn master, before it forks the workers. A forked
+worker shares the master's memory pages copy-on-write, so the weights of TrOCR, EasyOCR
+and M2M100 exist once in RAM no matter how many workers there are. Only what a worker
+writes to gets copied. Python's garbage collector would write to every object it looks
+at, so everything loaded up front is moved out of its sight with gc.freeze() first.
+
+Threads don't survive fork, so the job workers and the idle reaper are started in each
+worker after the fork, and every worker gets its share of the CPU cores for Tesseract and torch.
+Neither do SQLite connections: the job store connects per call and the translation
+memory opens one connection per process on first use, never in the master.
+'''
+
+import gc
+import logging
+import os
+import time
+
+from . import executor
+from .jobs import start_job_workers, reset_running_jobs, release_running_jobs
+from .models import registry, start_idle_reaper, current_rss, private_memory
+from .tesseract import pool as tesseract_pool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Models loaded in the master and shared by every worker ('all' for every registered model)
+PRELOAD_MODELS = os.environ.get('OCR_PRELOAD_MODELS', 'trocr,m2m100,easyocr_detector,easyocr_latin')
+# Worker processes (gunicorn --workers), 2 by default to keep a small machine responsive
+WORKERS = int(os.environ.get('OCR_WORKERS', '2'))
+# A worker whose private memory grows past this many MiB is replaced after its current request (0 = never)
+WORKER_MAX_MEMORY_MB = float(os.environ.get('OCR_WORKER_MAX_MEMORY_MB', '0'))
+
+
+def preload_models(names=None):
+    """Load the models in the master and freeze them for the GC, right before forking."""
+    if names is None:
+        names = PRELOAD_MODELS.strip()
+        names = None if names == 'all' else [name.strip() for name in names.split(',') if name.strip()]
+    start = time.perf_counter()
+    if names != []:
+        registry.warm(names)
+    # Workers start with a clean slate instead of collecting the master's garbage, and
+    # objects that survive until now are never scanned (or written to) by the GC again
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Preloaded models in {time.perf_counter() - start:.1f}s, master RSS {current_rss() / 2**20:.0f} MiB, "
+                f"{gc.get_freeze_count()} objects frozen")
+
+
+def prepare_master():
+    """Everything the master does once before forking workers."""
+    preload_models()
+    # Jobs interrupted by the last shutdown start over, in whichever worker gets them first
+    reset_running_jobs()
+
+
+def cpu_threads_per_worker(workers):
+    """The machine's cores split evenly between the workers (at least one each)."""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def init_worker(workers):
+    """Set up a freshly forked worker: its CPU share and the background threads."""
+    threads = cpu_threads_per_worker(workers)
+    executor.set_cpu_budget(threads)
+    # Tesseract engines are per worker, so don't keep more than this worker can use
+    tesseract_pool.max_size = min(tesseract_pool.max_size, executor.SUBPROCESS_WORKERS)
+    start_idle_reaper()
+    start_job_workers(reset_running=False)
+    logger.info(f"Worker {os.getpid()} ready with {threads} CPU threads, private memory {private_memory() / 2**20:.0f} MiB")
+
+
+def worker_over_memory():
+    """True when this worker uses more private memory than OCR_WORKER_MAX_MEMORY_MB."""
+    if WORKER_MAX_MEMORY_MB <= 0:
+        return False
+    used = private_memory()
+    if used > WORKER_MAX_MEMORY_MB * 2**20:
+        logger.info(f"Worker {os.getpid()} uses {used / 2**20:.0f} MiB private memory, recycling it")
+        return True
+    return False
+
+
+def shutdown_worker():
+    """A worker is going away (recycled or stopped): give its running jobs back."""
+    try:
+        release_running_jobs()
+    except Exception as e:
+        logger.error(f"Releasing jobs failed: {str(e)}")
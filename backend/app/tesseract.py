@@ -0,0 +1,188 @@
+'''
+This file talks to Tesseract. pytesseract starts a new `tesseract` process for every
+call, writes the image to a temp file and loads the traineddata again each time, which
+is a big fixed cost on every page. With tesserocr installed we instead keep initialized
+Tesseract engines in this process, a small pool per language/page-segmentation-mode,
+and hand them the image directly. Word boxes and confidences come out of the same pass.
+
+Without tesserocr (or with OCR_TESSERACT_BACKEND=pytesseract) everything goes through
+pytesseract exactly like before.
+'''
+
+import logging
+import os
+import queue
+import threading
+import time
+
+import pytesseract
+
+from .executor import SUBPROCESS_WORKERS
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# This one is default for Ubuntu users, but for the people using Windows, they need to configure this once.
+pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
+
+# Tesseract's own OpenMP threads fight with our thread pools, one per tesseract process is
+# plenty. Only the processes pytesseract starts get the limit: OMP_THREAD_LIMIT in this
+# process would also cap torch's OpenMP threads (TrOCR, EasyOCR, M2M100). pytesseract
+# passes its module's `environ` to every subprocess.
+pytesseract.pytesseract.environ = {'OMP_THREAD_LIMIT': '1', **os.environ}
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 'auto' uses tesserocr when it is installed, 'pytesseract' forces the subprocess path
+TESSERACT_BACKEND = os.environ.get('OCR_TESSERACT_BACKEND', 'auto')
+# Engines kept per language/PSM combination
+TESSERACT_POOL_SIZE = int(os.environ.get('OCR_TESSERACT_POOL_SIZE', str(SUBPROCESS_WORKERS)))
+
+
+def backend_name():
+    if TESSERACT_BACKEND == 'pytesseract' or tesserocr is None:
+        return 'pytesseract'
+    return 'tesserocr'
+
+
+class TesseractPool:
+    """Initialized tesserocr engines by (lang, psm), created on demand up to max_size each.
+
+    One engine is never used by two threads at once: callers borrow one with acquire()
+    and wait if all engines for their language are busy.
+    """
+
+    def __init__(self, max_size=TESSERACT_POOL_SIZE):
+        self.max_size = max(1, max_size)
+        self._idle = {}
+        self._created = {}
+        self._calls = {}
+        self._seconds = {}
+        self._lock = threading.Lock()
+
+    def _create(self, lang, psm):
+        start = time.perf_counter()
+        api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm, oem=tesserocr.OEM.DEFAULT)
+        logger.info(f"Started Tesseract engine lang={lang} psm={psm} in {time.perf_counter() - start:.2f}s")
+        return api
+
+    def acquire(self, lang, psm):
+        key = (lang, psm)
+        with self._lock:
+            idle = self._idle.setdefault(key, queue.Queue())
+            create = idle.empty() and self._created.get(key, 0) < self.max_size
+            if create:
+                self._created[key] = self._created.get(key, 0) + 1
+        if not create:
+            return idle.get()
+        try:
+            return self._create(lang, psm)
+        except Exception:
+            with self._lock:
+                self._created[key] -= 1
+            raise
+
+    def release(self, lang, psm, api, seconds):
+        key = (lang, psm)
+        with self._lock:
+            self._calls[key] = self._calls.get(key, 0) + 1
+            self._seconds[key] = self._seconds.get(key, 0.0) + seconds
+        self._idle[key].put(api)
+
+    def stats(self):
+        with self._lock:
+            return {
+                f"{lang}/psm{psm}": {
+                    'engines': self._created[(lang, psm)],
+                    'idle': self._idle[(lang, psm)].qsize(),
+                    'calls': self._calls.get((lang, psm), 0),
+                    'mean_ms': round(self._seconds.get((lang, psm), 0.0) * 1000 / self._calls[(lang, psm)], 1)
+                    if self._calls.get((lang, psm)) else 0.0,
+                }
+                for lang, psm in self._created
+            }
+
+
+pool = TesseractPool()
+
+
+def _words_tesserocr(api):
+    """Word boxes and confidences of the last Recognize() call."""
+    words = []
+    line = -1
+    level = tesserocr.RIL.WORD
+    iterator = api.GetIterator()
+    if iterator is None:
+        return words
+    for word in tesserocr.iterate_level(iterator, level):
+        if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+            line += 1
+        text = word.GetUTF8Text(level)
+        box = word.BoundingBox(level)
+        if not text or not text.strip() or box is None:
+            continue
+        left, top, right, bottom = box
+        words.append({
+            'text': text,
+            'conf': float(word.Confidence(level)),
+            'box': [left, top, right - left, bottom - top],
+            'line': max(line, 0),
+        })
+    return words
+
+
+def _recognize_tesserocr(image, lang, psm, words):
+    api = pool.acquire(lang, psm)
+    start = time.perf_counter()
+    try:
+        api.SetImage(image)  # Passed as an in-memory buffer, no temp file
+        api.Recognize()
+        result = {'text': api.GetUTF8Text(), 'words': _words_tesserocr(api) if words else []}
+        api.Clear()
+        return result
+    finally:
+        pool.release(lang, psm, api, time.perf_counter() - start)
+
+
+def _recognize_pytesseract(image, lang, psm, words):
+    config = f"--psm {psm} --oem 3 -l {lang}"
+    if not words:
+        return {'text': pytesseract.image_to_string(image, config=config), 'words': []}
+
+    data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+    found = []
+    lines = {}
+    for i, text in enumerate(data['text']):
+        conf = float(data['conf'][i])
+        if not text.strip() or conf < 0:
+            continue
+        line = lines.setdefault((data['block_num'][i], data['par_num'][i], data['line_num'][i]), len(lines))
+        found.append({
+            'text': text,
+            'conf': conf,
+            'box': [data['left'][i], data['top'][i], data['width'][i], data['height'][i]],
+            'line': line,
+        })
+    # image_to_data has no plain text output, so rebuild the lines from the words
+    by_line = {}
+    for word in found:
+        by_line.setdefault(word['line'], []).append(word['text'])
+    return {'text': '\n'.join(' '.join(line) for line in by_line.values()), 'words': found}
+
+
+def recognize(image, lang='eng', psm=6, words=False):
+    """OCR one image. Returns {'text', 'words'}; with words=True every word comes with
+    its confidence (0-100), box [left, top, width, height] and line index."""
+    if backend_name() == 'tesserocr':
+        try:
+            return _recognize_tesserocr(image, lang, psm, words)
+        except Exception as e:
+            logger.error(f"tesserocr failed, falling back to pytesseract: {str(e)}")
+    return _recognize_pytesseract(image, lang, psm, words)
+
+
+def tesseract_stats():
+    return {'backend': backend_name(), 'pool_size': pool.max_size, 'engines': pool.stats()}
@@ -1,37 +1,57 @@
 # This file helps translate text from one language to another.
-import torch
-from transformers import M2M100ForConditionalGeneration, M2M100Tokenizer
 from langdetect import detect
-import logging
-import os
-
-# Ensure dependencies are installed
-required_packages = ['torch', 'transformers', 'langdetect', 'unidecode', 'indic-transliteration']
-
-# Checks for all the tools we need and installs them if they're missing.
-for package in required_packages:
-    try:
-        __import__(package)
-    except ImportError:
-        print(f"Installing {package}...")
-        os.system(f"pip install {package}")
-
 from unidecode import unidecode
 from indic_transliteration import sanscript
+import logging
+import os
+import functools
+import re
+from .models import registry
+from .backends import MODEL_BACKEND, register_backend_model, load_backend_model
+from .scheduler import BatchScheduler
+from .cache import translation_memory, normalize_segment
+from .metrics import metrics, stage, LOG_TEXT
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load M2M-100 model and tokenizer
-model_name = "facebook/m2m100_418M"
-tokenizer = M2M100Tokenizer.from_pretrained(model_name)
-model = M2M100ForConditionalGeneration.from_pretrained(model_name)
-
 # Force CPU usage (avoid CUDA issues)
 DEVICE = "cpu"
-model.to(DEVICE)
-logger.info(f"Using device: {DEVICE}")
+
+# How the model searches for a translation. 'beam' is the old behaviour; 'greedy' is
+# several times cheaper and usually good enough for short UI strings.
+DECODING_PROFILES = {
+    'greedy': {'num_beams': 1},
+    'small_beam': {'num_beams': 2},
+    'beam': {'num_beams': 5},
+}
+DEFAULT_PROFILE = os.environ.get('TRANSLATE_PROFILE', 'beam')
+# Long text is split into sentences/chunks of at most this many tokens, which are
+# translated TRANSLATE_BATCH_SIZE at a time
+MAX_SEGMENT_TOKENS = int(os.environ.get('TRANSLATE_MAX_SEGMENT_TOKENS', '200'))
+BATCH_SIZE = int(os.environ.get('TRANSLATE_BATCH_SIZE', '8'))
+
+# M2M-100 model and tokenizer, loaded the first time something gets translated
+model_name = "facebook/m2m100_418M"
+
+@functools.lru_cache(maxsize=None)
+def _m2m100_tokenizer():
+    from transformers import M2M100Tokenizer
+    return M2M100Tokenizer.from_pretrained(model_name)
+
+def _load_m2m100_fp32():
+    from transformers import M2M100ForConditionalGeneration
+    model = M2M100ForConditionalGeneration.from_pretrained(model_name)
+    model.to(DEVICE)
+    logger.info(f"Using device: {DEVICE}")
+    return model
+
+def _load_m2m100():
+    # The model runs on OCR_MODEL_BACKEND (fp32, int8 or onnx, see backends.py)
+    return _m2m100_tokenizer(), load_backend_model('m2m100')
+
+registry.register('m2m100', _load_m2m100, f'M2M100 418M translation ({MODEL_BACKEND})')
 
 # Supported languages (matches your Form.js options)
 LANG_MAP = {
@@ -70,20 +90,116 @@ def roman_to_devanagari(text):
 
         # Convert to Devanagari using ITRANS
         devanagari_text = sanscript.transliterate(text, sanscript.ITRANS, sanscript.DEVANAGARI)
-        logger.info(f"Converted Roman to Devanagari: {devanagari_text[:50]}...")
+        if LOG_TEXT:
+            logger.info(f"Converted Roman to Devanagari: {devanagari_text[:50]}...")
         return devanagari_text
     except Exception as e:
         logger.error(f"Roman to Devanagari conversion failed: {str(e)}")
         return text
 
-def translate_text(text, file, source_lang, target_lang):
+# Sentence ends (including the Devanagari danda) followed by whitespace
+SENTENCE_END = re.compile(r'(?<=[.!?\u0964])\s+')
+
+def split_segments(text, tokenizer, max_tokens=MAX_SEGMENT_TOKENS):
+    """Split text into lines of sentences, each sentence short enough for the model.
+
+    Returns a list of lines, each a list of segments, so the layout can be put back together.
+    """
+    lines = []
+    for line in text.split('\n'):
+        segments = []
+        for sentence in SENTENCE_END.split(line.strip()):
+            if not sentence:
+                continue
+            if len(tokenizer.tokenize(sentence)) <= max_tokens:
+                segments.append(sentence)
+                continue
+            # Sentence is too long for one pass: cut it into word chunks that fit
+            chunk = []
+            chunk_tokens = 0
+            for word in sentence.split():
+                word_tokens = len(tokenizer.tokenize(word))
+                if chunk and chunk_tokens + word_tokens > max_tokens:
+                    segments.append(' '.join(chunk))
+                    chunk, chunk_tokens = [], 0
+                chunk.append(word)
+                chunk_tokens += word_tokens
+            if chunk:
+                segments.append(' '.join(chunk))
+        lines.append(segments)
+    return lines
+
+def m2m100_generate(tokenizer, model, segments, src_lang, tgt_lang, profile):
+    """One padded generate call for segments that share a language pair and profile."""
+    tokenizer.src_lang = src_lang
+    inputs = tokenizer(segments, return_tensors="pt", padding=True).to(DEVICE)
+    translated_ids = model.generate(
+        **inputs,
+        forced_bos_token_id=tokenizer.get_lang_id(tgt_lang),
+        # Room for the translation to be a bit longer than the source
+        max_new_tokens=int(inputs['input_ids'].shape[1] * 2) + 10,
+        **DECODING_PROFILES[profile]
+    )
+    return tokenizer.batch_decode(translated_ids, skip_special_tokens=True)
+
+def _run_m2m100_batch(key, segments):
+    src_lang, tgt_lang, profile = key
+    tokenizer, model = registry.get('m2m100')
+    # Only the scheduler thread touches the tokenizer's src_lang, so this is safe
+    return m2m100_generate(tokenizer, model, segments, src_lang, tgt_lang, profile)
+
+register_backend_model(
+    'm2m100', model_name, _load_m2m100_fp32, 'ORTModelForSeq2SeqLM',
+    lambda model, texts: m2m100_generate(_m2m100_tokenizer(), model, texts, 'en', 'fr', DEFAULT_PROFILE)
+)
+
+# Segments from all concurrent requests are batched together (see scheduler.py)
+_m2m100_scheduler = BatchScheduler('m2m100', _run_m2m100_batch, BATCH_SIZE)
+
+def translate_segments(segments, src_lang, tgt_lang, profile=None):
+    """Translate a list of segments, batching segments of similar length together."""
+    profile = profile if profile in DECODING_PROFILES else DEFAULT_PROFILE
+    tokenizer, model = registry.get('m2m100')
+
+    # Queuing the segments shortest first keeps the padding inside each batch small
+    lengths = [len(tokenizer.tokenize(segment)) for segment in segments]
+    order = sorted(range(len(segments)), key=lambda i: lengths[i])
+    results = _m2m100_scheduler.run([segments[i] for i in order], key=(src_lang, tgt_lang, profile))
+
+    translations = [None] * len(segments)
+    for i, translated in zip(order, results):
+        translations[i] = translated
+    return translations
+
+def translate_segments_cached(segments, src_lang, tgt_lang, profile=None):
+    """translate_segments, but segments we've translated before come from the translation
+    memory and only the unique misses go through the model."""
+    profile = profile if profile in DECODING_PROFILES else DEFAULT_PROFILE
+    translations = translation_memory.lookup(src_lang, tgt_lang, profile, segments)
+
+    # Repeated segments in the same document are only translated once
+    missing = list(dict.fromkeys(
+        normalize_segment(segment) for segment, translation in zip(segments, translations) if translation is None
+    ))
+    if missing:
+        new = dict(zip(missing, translate_segments(missing, src_lang, tgt_lang, profile)))
+        translation_memory.store(src_lang, tgt_lang, profile, new.items())
+        translations = [
+            translation if translation is not None else new[normalize_segment(segment)]
+            for segment, translation in zip(segments, translations)
+        ]
+    logger.info(f"Translation memory: {len(segments) - len(missing)} of {len(segments)} segments reused")
+    return translations
+
+def translate_text(text, file, source_lang, target_lang, profile=None):
     """Translate text from source_lang to target_lang, handling Romanized Hindi."""
     try:
         # If a file is provided, extract text using OCR
         if file:
             from .ocr import ocr_process
             text = ocr_process("", file, lang=source_lang if source_lang != 'auto' else 'en')
-            logger.info(f"OCR extracted text: {text[:100]}...")
+            if LOG_TEXT:
+                logger.info(f"OCR extracted text: {text[:100]}...")
 
         if not text:
             logger.warning("No text to translate")
@@ -104,26 +220,28 @@ def translate_text(text, file, source_lang, target_lang):
         if src_lang == 'hi' and not any(ord(c) >= 2304 and ord(c) <= 2431 for c in text):
             text = roman_to_devanagari(text)
 
-        # Transliterate (for logging/debugging, not returned)
-        transliterated = transliterate_text(text, src_lang)
+        # Transliterate (for logging/debugging, not returned), only worth it when we log the text
+        if LOG_TEXT:
+            transliterate_text(text, src_lang)
 
         # Skip translation if source and target are the same
         if src_lang == tgt_lang:
             logger.info(f"Source ({src_lang}) and target ({tgt_lang}) are the same")
             return text
 
-        # Translate
-        tokenizer.src_lang = src_lang
-        inputs = tokenizer(text, return_tensors="pt", padding=True).to(DEVICE)
-        translated_ids = model.generate(
-            **inputs,
-            forced_bos_token_id=tokenizer.get_lang_id(tgt_lang),
-            max_length=256,
-            num_beams=5
-        )
-        translated = tokenizer.batch_decode(translated_ids, skip_special_tokens=True)[0]
-        logger.info(f"Translated from {src_lang} to {tgt_lang}: {translated}")
+        # Translate sentence by sentence, so long documents aren't cut off at the model's limit
+        with stage('translate'):
+            tokenizer, model = registry.get('m2m100')
+            lines = split_segments(text, tokenizer)
+            segments = [segment for line in lines for segment in line]
+            translations = iter(translate_segments_cached(segments, src_lang, tgt_lang, profile))
+            translated = '\n'.join(' '.join(next(translations) for _ in line) for line in lines)
+        if LOG_TEXT:
+            logger.info(f"Translated from {src_lang} to {tgt_lang}: {translated}")
+        else:
+            logger.info(f"Translated {len(text)} characters from {src_lang} to {tgt_lang}")
         return translated
     except Exception as e:
         logger.error(f"Translation failed: {str(e)}")
+        metrics.inc('ocr_translation_errors_total')
         raise Exception(f"Translation failed: {str(e)}")
\ No newline at end of file
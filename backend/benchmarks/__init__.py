@@ -0,0 +1,2 @@
+# Offline benchmarks for the OCR pipeline. Run them from the backend folder, e.g.
+# python -m benchmarks.code_classifier
@@ -0,0 +1,294 @@
+'''
+Deterministic test images rendered with PIL, so the benchmarks need no downloads
+and every run sees exactly the same pages (and knows the right answer for each).
+'''
+
+import io
+import os
+import random
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+FONT_DIRS = ['/usr/share/fonts', '/usr/local/share/fonts', '/Library/Fonts', 'C:\\Windows\\Fonts']
+MONO_FONTS = ['DejaVuSansMono.ttf', 'LiberationMono-Regular.ttf', 'Courier New.ttf', 'cour.ttf']
+SANS_FONTS = ['DejaVuSans.ttf', 'LiberationSans-Regular.ttf', 'Arial.ttf', 'arial.ttf']
+SERIF_FONTS = ['DejaVuSerif.ttf', 'LiberationSerif-Regular.ttf', 'Times New Roman.ttf', 'times.ttf']
+DEVANAGARI_FONTS = ['NotoSansDevanagari-Regular.ttf', 'Lohit-Devanagari.ttf', 'Mangal.ttf', 'Nirmala.ttf']
+
+PROSE = (
+    "The committee reviewed the quarterly report and approved the revised budget for the next "
+    "financial year. Members agreed that spending on maintenance should be reduced while the "
+    "training programme is extended to all regional offices. A final decision on the new office "
+    "lease will be taken at the next meeting, once the legal team has reviewed the contract. "
+    "Please send any comments on the draft minutes to the secretary before the end of the month."
+).split()
+
+# The same kind of text in every language the app offers, for the multilingual runs
+LANGUAGE_PROSE = {
+    'en': ' '.join(PROSE),
+    'fr': ("Le comité a examiné le rapport trimestriel et approuvé le budget révisé pour l'année "
+           "prochaine. Les membres ont convenu de réduire les dépenses d'entretien et d'étendre le "
+           "programme de formation à tous les bureaux régionaux avant la fin du mois."),
+    'de': ("Der Ausschuss hat den Quartalsbericht geprüft und den überarbeiteten Haushalt für das "
+           "nächste Jahr genehmigt. Die Mitglieder waren sich einig, dass die Ausgaben für Wartung "
+           "gesenkt und das Schulungsprogramm auf alle Regionalbüros ausgeweitet werden soll."),
+    'es': ("El comité revisó el informe trimestral y aprobó el presupuesto revisado para el próximo "
+           "año. Los miembros acordaron reducir el gasto en mantenimiento y ampliar el programa de "
+           "formación a todas las oficinas regionales antes de fin de mes."),
+    'ru': ("Комитет рассмотрел квартальный отчёт и утвердил пересмотренный бюджет на следующий год. "
+           "Члены комитета согласились сократить расходы на обслуживание и расширить программу "
+           "обучения на все региональные офисы до конца месяца."),
+    'hi': ("समिति ने तिमाही रिपोर्ट की समीक्षा की और अगले वर्ष के लिए संशोधित बजट को मंजूरी दी। "
+           "सदस्यों ने सहमति व्यक्त की कि रखरखाव पर खर्च कम किया जाए और प्रशिक्षण कार्यक्रम को "
+           "सभी क्षेत्रीय कार्यालयों तक बढ़ाया जाए।"),
+}
+# Fonts to try per language, the first one installed is used
+LANGUAGE_FONTS = {'hi': [DEVANAGARI_FONTS]}
+
+CODE_SNIPPETS = [
+    [
+        "def merge_results(results):",
+        "    valid = [r for r in results if r.strip()]",
+        "    if not valid:",
+        "        return ''",
+        "    # Prefer the longest result",
+        "    return max(valid, key=lambda x: len(x.split()))",
+    ],
+    [
+        "function fetchData(url) {",
+        "  return fetch(url)",
+        "    .then(res => res.json())",
+        "    .catch(err => {",
+        "      console.error(err);",
+        "    });",
+        "}",
+    ],
+    [
+        "for (int i = 0; i < n; i++) {",
+        "    if (values[i] > max) {",
+        "        max = values[i];",
+        "    }",
+        "}",
+        "return max;",
+    ],
+    [
+        "class Cache:",
+        "    def __init__(self, size):",
+        "        self.size = size",
+        "        self.items = {}",
+        "",
+        "    def get(self, key):",
+        "        return self.items.get(key)",
+    ],
+]
+
+# Editor colour themes: background, plain text, and highlight colours
+THEMES = [
+    ((30, 30, 30), (212, 212, 212), [(86, 156, 214), (206, 145, 120), (106, 153, 85), (197, 134, 192)]),
+    ((40, 44, 52), (171, 178, 191), [(198, 120, 221), (152, 195, 121), (229, 192, 123), (97, 175, 239)]),
+    ((255, 255, 255), (0, 0, 0), [(0, 0, 255), (163, 21, 21), (0, 128, 0), (175, 0, 219)]),
+    ((253, 246, 227), (101, 123, 131), [(38, 139, 210), (42, 161, 152), (133, 153, 0), (211, 54, 130)]),
+]
+
+
+def font_path(names):
+    """Path of the first installed font from names, or None."""
+    for directory in FONT_DIRS:
+        for root, _, files in os.walk(directory):
+            for name in names:
+                if name in files:
+                    return os.path.join(root, name)
+    return None
+
+
+def find_font(names, size):
+    """First installed font from names, or PIL's built-in font."""
+    path = font_path(names)
+    if path:
+        return ImageFont.truetype(path, size)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def wrap_words(words, font, width):
+    lines, line = [], []
+    for word in words:
+        candidate = ' '.join(line + [word])
+        if line and font.getlength(candidate) > width:
+            lines.append(' '.join(line))
+            line = [word]
+        else:
+            line.append(word)
+    if line:
+        lines.append(' '.join(line))
+    return lines
+
+
+def render_document(rng, width=1200, font_size=22, font_names=SANS_FONTS, prose=None):
+    """A page of prose paragraphs in black on white. Returns (image, text)."""
+    font = find_font(font_names, font_size)
+    image = Image.new('RGB', (width, int(width * 1.3)), 'white')
+    draw = ImageDraw.Draw(image)
+    y = 60
+    lines = []
+    prose = prose or PROSE
+    for _ in range(rng.randint(2, 4)):
+        words = prose[rng.randint(0, 10):]
+        rng.shuffle(words)
+        for line in wrap_words(words[:rng.randint(25, 60)], font, width - 160):
+            draw.text((80, y), line, fill='black', font=font)
+            lines.append(line)
+            y += int(font_size * 1.5)
+        y += font_size
+        if y > image.height - 100:
+            break
+    return image, '\n'.join(lines)
+
+
+RECEIPT_ITEMS = ["Coffee (large)", "Sandwich", "Water 0.5l", "Muffin (blueberry)", "Tea", "Salad bowl"]
+
+
+def render_receipt(rng, width=700, font_size=22):
+    """A shop receipt: short lines, prices, brackets and '=' signs, but not code."""
+    font = find_font(SANS_FONTS, font_size)
+    lines = ["CORNER CAFE", "12 Market Street", ""]
+    total = 0.0
+    for item in rng.sample(RECEIPT_ITEMS, 4):
+        price = rng.randint(150, 990) / 100
+        total += price
+        lines.append(f"{item:<24} {price:>7.2f}")
+    lines += ["", f"Total (incl. VAT) = {total:.2f}", "Thank you for your visit!"]
+    image = Image.new('RGB', (width, len(lines) * int(font_size * 1.6) + 120), 'white')
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((60, 60 + i * font_size * 1.6), line, fill='black', font=font)
+    return image, '\n'.join(lines)
+
+
+def render_code(rng, theme=None, font_size=20, highlight=True):
+    """An editor screenshot of a code snippet. Returns (image, text)."""
+    background, plain, colours = theme or rng.choice(THEMES)
+    font = find_font(MONO_FONTS, font_size)
+    snippet = rng.choice(CODE_SNIPPETS)
+    width = int(max(font.getlength(line) for line in snippet)) + 120
+    height = int(len(snippet) * font_size * 1.6) + 80
+    image = Image.new('RGB', (width, height), background)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(snippet):
+        x = 40
+        for word in line.split(' '):
+            colour = rng.choice(colours) if highlight and word.strip() and rng.random() < 0.5 else plain
+            draw.text((x, 40 + i * font_size * 1.6), word, fill=colour, font=font)
+            x += font.getlength(word + ' ')
+    return image, '\n'.join(snippet)
+
+
+def code_classifier_set(seed=0, size=40):
+    """Labeled pages for the code detector: (image, is_code) pairs, half of each."""
+    rng = random.Random(seed)
+    samples = []
+    for i in range(size):
+        if i % 2 == 0:
+            image, _ = render_code(rng, font_size=rng.choice([16, 20, 26]), highlight=rng.random() < 0.7)
+            samples.append((image, True))
+        elif i % 6 == 1:
+            image, _ = render_receipt(rng, font_size=rng.choice([18, 22]))
+            samples.append((image, False))
+        else:
+            fonts = rng.choice([SANS_FONTS, SERIF_FONTS])
+            image, _ = render_document(rng, width=rng.choice([900, 1200]), font_size=rng.choice([18, 22, 28]), font_names=fonts)
+            samples.append((image, False))
+    return samples
+
+
+def add_noise(image, rng, level):
+    """Make a clean render look scanned or photographed. Level 0 is clean, 1 is a decent
+    scan, 2 is a bad one (more grain, blur, skew and JPEG artifacts)."""
+    if level <= 0:
+        return image
+    gray = image.convert('L')
+    # Seeded grain (Image.effect_noise isn't), so the same seed gives the same bytes
+    grain = np.random.default_rng(rng.randrange(2**32)).normal(0, 14 * level, (gray.height, gray.width))
+    gray = Image.fromarray(np.clip(np.asarray(gray, dtype=np.float32) + grain, 0, 255).astype(np.uint8))
+    gray = gray.filter(ImageFilter.GaussianBlur(0.4 * level))
+    gray = gray.rotate(rng.uniform(-1.0, 1.0) * level, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255)
+    buf = io.BytesIO()
+    gray.save(buf, 'JPEG', quality=max(30, 85 - 25 * level))
+    return Image.open(io.BytesIO(buf.getvalue())).convert('RGB')
+
+
+def encode_image(image, fmt='PNG'):
+    buf = io.BytesIO()
+    image.save(buf, fmt, **({'quality': 90} if fmt == 'JPEG' else {}))
+    return buf.getvalue()
+
+
+def encode_pdf(images, dpi=200):
+    """Image-only PDF (no text layer), so every page goes through OCR."""
+    buf = io.BytesIO()
+    fixed = time.strptime('2025-01-01', '%Y-%m-%d')  # No real timestamps, so the bytes stay the same
+    images[0].save(buf, 'PDF', save_all=True, append_images=images[1:], resolution=dpi,
+                   creationDate=fixed, modDate=fixed)
+    return buf.getvalue()
+
+
+def _case(case_id, kind, content, mimetype, text, **info):
+    return dict(id=case_id, kind=kind, content=content, mimetype=mimetype, text=text, **info)
+
+
+def benchmark_corpus(seed=0, quick=False):
+    """Every benchmark case: uploads with known text, covering fonts, sizes, languages,
+    noise levels, code screenshots, a receipt and multi-page PDFs.
+
+    Each case is a dict with id, kind, content (bytes), mimetype, text (ground truth),
+    lang and whatever it was rendered with. Same seed, same bytes.
+    """
+    rng = random.Random(seed)
+    cases = []
+    languages = ['en'] if quick else list(LANGUAGE_PROSE)
+    noise_levels = [0, 2] if quick else [0, 1, 2]
+    families = [('sans', SANS_FONTS), ('serif', SERIF_FONTS), ('mono', MONO_FONTS)]
+    sizes = [14, 22, 32]
+
+    for lang_index, lang in enumerate(languages):
+        font_choices = LANGUAGE_FONTS.get(lang)
+        if font_choices:
+            families_for_lang = [(lang, names) for names in font_choices if font_path(names)]
+            if not families_for_lang:
+                continue  # No font for this script installed, nothing to render
+        else:
+            families_for_lang = families
+        for i, noise in enumerate(noise_levels):
+            family, names = families_for_lang[i % len(families_for_lang)]
+            size = sizes[(i + lang_index) % len(sizes)]
+            image, text = render_document(rng, width=1400, font_size=size, font_names=names,
+                                          prose=LANGUAGE_PROSE[lang].split())
+            image = add_noise(image, rng, noise)
+            fmt = 'JPEG' if noise else 'PNG'
+            cases.append(_case(f"doc-{lang}-{family}-{size}-n{noise}", 'document', encode_image(image, fmt),
+                               f"image/{fmt.lower()}", text, lang=lang, font=family, font_size=size, noise=noise))
+
+    for i, theme in enumerate(THEMES[:2] if quick else THEMES):
+        size = [14, 18, 22, 26][i % 4]
+        image, text = render_code(rng, theme, font_size=size)
+        cases.append(_case(f"code-{i}-{size}", 'code', encode_image(image), 'image/png', text,
+                           lang='en', font='mono', font_size=size, noise=0))
+
+    if not quick:
+        image, text = render_receipt(rng)
+        cases.append(_case('receipt', 'receipt', encode_image(image), 'image/png', text,
+                           lang='en', font='sans', font_size=22, noise=0))
+
+    for i in range(1 if quick else 2):
+        pages, texts = [], []
+        for _ in range(3):
+            image, text = render_document(rng, width=1654, font_size=28, font_names=SANS_FONTS)
+            pages.append(add_noise(image, rng, i))
+            texts.append(text)
+        cases.append(_case(f"pdf-{len(pages)}p-n{i}", 'pdf', encode_pdf(pages), 'application/pdf', '\n'.join(texts),
+                           lang='en', font='sans', font_size=28, noise=i, pages=len(pages)))
+    return cases
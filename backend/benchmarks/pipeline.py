@@ -0,0 +1,329 @@
+'''
+End-to-end benchmark of the OCR and translation pipelines on the rendered corpus.
+
+    python -m benchmarks.pipeline [--quick] [--mode cascade] [--translate] [--output bench.json]
+    python -m benchmarks.pipeline --baseline baseline.json      # run, then compare
+    python -m benchmarks.pipeline --compare bench.json --baseline baseline.json
+
+Every upload goes through the same code as /process (open_pages -> iter_ocr_pages) with
+the result cache and translation memory turned off. Each page is then run once more
+stage by stage (code detection, every preprocessing variant, every engine on its own)
+to show where the time goes. The text is scored against the rendered ground truth
+with the character error rate (CER).
+
+Throughput, latency and peak memory only cover the pipeline pass. The stage pass and
+the translations are timed separately (stage_pass_seconds, translate_seconds).
+'''
+
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+from app.backends import MODEL_BACKEND, character_error_rate
+from app.cache import ocr_cache, translation_memory
+from app.executor import run_engines
+from app.models import PeakRSS, current_rss
+from app.ocr import (OCR_MODE, NON_CODE_ENGINES, TEXT_REGIONS, PreparedPage, detect_code, iter_ocr_pages,
+                     ocr_for_code, open_pages, page_result)
+from app.tesseract import backend_name as tesseract_backend
+from .corpus import benchmark_corpus
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Preprocessing variants timed in the stage pass, in the order the pipeline builds them
+VARIANTS = ['thumbnail', 'x_height', 'regions', 'region_pages', 'tesseract', 'lines', 'code']
+
+# For the comparison: which summary metrics are better when lower and when higher
+LOWER_IS_BETTER = ['mean_cer', 'seconds_per_page_p50', 'seconds_per_page_p95', 'peak_rss_bytes', 'total_seconds']
+HIGHER_IS_BETTER = ['pages_per_second']
+
+
+def normalize(text):
+    """Compare texts the way post_process_text leaves them: single spaces, no edges."""
+    return re.sub(r'\s+', ' ', text or '').strip()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def mean(values):
+    return sum(values) / len(values) if values else 0.0
+
+
+def run_stages(image, lang, mode):
+    """One page, stage by stage. Returns milliseconds per stage."""
+    page = PreparedPage(image)
+    stages = {}
+
+    start = time.perf_counter()
+    is_code, _ = detect_code(page)
+    stages['code_detection'] = (time.perf_counter() - start) * 1000
+
+    for name in VARIANTS:
+        if (name == 'code' and not is_code) or (name == 'regions' and not TEXT_REGIONS):
+            continue
+        for region in ([page] if name in ('thumbnail', 'x_height', 'regions', 'region_pages', 'code') else page.regions()):
+            region.variant(name)
+            stages[f'preprocess.{name}'] = stages.get(f'preprocess.{name}', 0.0) + region.report(name).get('ms', 0.0)
+
+    # Variants are cached on the page by now, so these are the engines alone
+    engines = ['code'] if is_code else (['tesseract'] if mode == 'cascade' else NON_CODE_ENGINES)
+    for name in engines:
+        start = time.perf_counter()
+        if name == 'code':
+            ocr_for_code(page)
+        else:
+            run_engines([name], page, lang)
+        stages[f'engine.{name}'] = (time.perf_counter() - start) * 1000
+    return {name: round(ms, 2) for name, ms in stages.items()}
+
+
+def run_case(case, mode, translate):
+    """The case through the real pipeline, then page by page through the stages."""
+    result = {key: value for key, value in case.items() if key not in ('content', 'text')}
+
+    with PeakRSS() as memory:
+        start = time.perf_counter()
+        page_count, sources = open_pages(case['content'], case['mimetype'])
+        pages, texts = [], []
+        for page in iter_ocr_pages(sources, page_count, case['lang'], mode):
+            pages.append(page)
+            text = page_result(page)
+            if text is not None:
+                texts.append(text)
+        seconds = time.perf_counter() - start
+
+    hypothesis = normalize('\n'.join(texts))
+    reference = normalize(case['text'])
+    result.update(
+        pages=page_count,
+        seconds=round(seconds, 4),
+        seconds_per_page=round(seconds / max(page_count, 1), 4),
+        cer=round(character_error_rate(reference, hypothesis), 4),
+        rss_peak_bytes=memory.stats()['rss_peak_bytes'],
+        peak_rss_increase_bytes=memory.stats()['peak_increase_bytes'],
+        page_types=[page['type'] for page in pages],
+        decode_ms=[(page.get('preprocess') or {}).get('decode_ms') for page in pages],
+        sample=hypothesis[:120],
+    )
+
+    # Stage pass: decode again and time every stage of every page on its own
+    stage_totals = {}
+    start = time.perf_counter()
+    page_count, sources = open_pages(case['content'], case['mimetype'])
+    for _, source in sources:
+        for name, ms in run_stages(source, case['lang'], mode).items():
+            stage_totals[name] = stage_totals.get(name, 0.0) + ms
+    result['stage_pass_seconds'] = round(time.perf_counter() - start, 4)
+    result['stages_ms'] = {name: round(ms / max(page_count, 1), 2) for name, ms in stage_totals.items()}
+
+    if translate and case['kind'] != 'code':
+        from app.translate import translate_text
+        target = 'fr' if case['lang'] == 'en' else 'en'
+        start = time.perf_counter()
+        translation = translate_text(case['text'], None, case['lang'], target)
+        result['translate'] = {
+            'target': target,
+            'seconds': round(time.perf_counter() - start, 4),
+            'chars': len(case['text']),
+            'sample': translation[:120],
+        }
+    return result
+
+
+def summarize(cases):
+    """Overall numbers plus CER and latency per kind, language, noise level, font and size.
+
+    Totals add up the pipeline pass of every case only, not the stage pass or translation.
+    """
+    pages = sum(case['pages'] for case in cases)
+    total_seconds = sum(case['seconds'] for case in cases)
+    per_page = [case['seconds_per_page'] for case in cases]
+    summary = {
+        'cases': len(cases),
+        'pages': pages,
+        'total_seconds': round(total_seconds, 3),
+        'pages_per_second': round(pages / total_seconds, 3) if total_seconds else 0.0,
+        'seconds_per_page_p50': round(percentile(per_page, 50), 4),
+        'seconds_per_page_p95': round(percentile(per_page, 95), 4),
+        'mean_cer': round(mean([case['cer'] for case in cases]), 4),
+        'peak_rss_bytes': max(case['rss_peak_bytes'] for case in cases),
+        'stage_pass_seconds': round(sum(case['stage_pass_seconds'] for case in cases), 3),
+    }
+
+    stages = {}
+    for case in cases:
+        for name, ms in case['stages_ms'].items():
+            stages.setdefault(name, []).append(ms)
+    summary['stages_ms'] = {name: round(mean(values), 2) for name, values in sorted(stages.items())}
+
+    translations = [case['translate'] for case in cases if 'translate' in case]
+    if translations:
+        seconds = sum(t['seconds'] for t in translations)
+        summary['translate_seconds'] = round(seconds, 3)
+        summary['translate_chars_per_second'] = round(sum(t['chars'] for t in translations) / seconds, 1) if seconds else 0.0
+
+    groups = {}
+    for field in ('kind', 'lang', 'noise', 'font', 'font_size'):
+        by_value = {}
+        for case in cases:
+            by_value.setdefault(str(case.get(field)), []).append(case)
+        groups[field] = {
+            value: {
+                'cases': len(members),
+                'mean_cer': round(mean([c['cer'] for c in members]), 4),
+                'seconds_per_page': round(mean([c['seconds_per_page'] for c in members]), 4),
+            }
+            for value, members in sorted(by_value.items())
+        }
+    summary['groups'] = groups
+    return summary
+
+
+# Settings that decide which cases run, so the totals of two reports only compare when they match
+CORPUS_SETTINGS = ['seed', 'quick', 'only', 'mode']
+
+
+def corpus_mismatch(report, baseline):
+    """The corpus settings that differ between two reports."""
+    current, previous = report.get('meta', {}), baseline.get('meta', {})
+    return [name for name in CORPUS_SETTINGS if current.get(name) != previous.get(name)]
+
+
+def compare(report, baseline, tolerance):
+    """Summary metrics side by side with the baseline. A metric regresses when it is more
+    than `tolerance` (a fraction) worse; CER also needs to be 0.01 worse in absolute terms."""
+    rows = []
+    current, previous = report['summary'], baseline['summary']
+    for name in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+        if name not in current or name not in previous:
+            continue
+        new, old = current[name], previous[name]
+        change = (new - old) / old if old else 0.0
+        worse = change > tolerance if name in LOWER_IS_BETTER else change < -tolerance
+        if name == 'mean_cer':
+            worse = worse and new - old > 0.01
+        rows.append({'metric': name, 'baseline': old, 'current': new, 'change': round(change, 4), 'regression': worse})
+
+    # Per-stage latency, so a slower stage shows up even if the total hides it
+    for name, new in current.get('stages_ms', {}).items():
+        old = previous.get('stages_ms', {}).get(name)
+        if not old:
+            continue
+        change = (new - old) / old
+        rows.append({'metric': f'stage.{name}', 'baseline': old, 'current': new, 'change': round(change, 4),
+                     'regression': change > tolerance and new - old > 5})
+    return rows
+
+
+def print_comparison(rows):
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        print(f"{row['metric']:<40} {row['baseline']:>14} -> {row['current']:>14} ({row['change'] * 100:+.1f}%){flag}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='English only, fewer noise levels and PDFs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=['all', 'cascade'], default=OCR_MODE)
+    parser.add_argument('--translate', action='store_true', help='Also time translating every ground truth text')
+    parser.add_argument('--only', help='Only run cases whose id contains this')
+    parser.add_argument('--output', default='benchmark_report.json')
+    parser.add_argument('--baseline', help='Earlier report to compare against')
+    parser.add_argument('--compare', help='Compare this existing report against --baseline instead of running')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed slowdown before a metric counts as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        if not args.baseline:
+            parser.error('--compare needs --baseline')
+        with open(args.compare, encoding='utf-8') as f:
+            report = json.load(f)
+    else:
+        # Measure the pipeline, not the caches
+        ocr_cache.enabled = False
+        translation_memory.enabled = False
+
+        cases = benchmark_corpus(args.seed, args.quick)
+        if args.only:
+            cases = [case for case in cases if args.only in case['id']]
+        if not cases:
+            parser.error('No benchmark cases selected')
+
+        # One untimed run so model loading doesn't count against the first case
+        try:
+            run_case(cases[0], args.mode, args.translate)
+        except Exception as e:
+            logger.error(f"Warm-up run failed: {str(e)}")
+
+        results, failed = [], []
+        rss_start = current_rss()
+        for case in cases:
+            try:
+                results.append(run_case(case, args.mode, args.translate))
+                print(f"{case['id']:<28} {results[-1]['seconds']:>8.3f}s  CER {results[-1]['cer']:.3f}", file=sys.stderr)
+            except Exception as e:
+                # e.g. PDFs without poppler installed, keep going with the other cases
+                failed.append({'id': case['id'], 'error': str(e)})
+                print(f"{case['id']:<28} failed: {str(e)}", file=sys.stderr)
+        if not results:
+            sys.exit('Every benchmark case failed')
+
+        report = {
+            'meta': {
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'cpu_count': os.cpu_count(),
+                'seed': args.seed,
+                'quick': args.quick,
+                'only': args.only,
+                'mode': args.mode,
+                'model_backend': MODEL_BACKEND,
+                'tesseract_backend': tesseract_backend(),
+                'rss_start_bytes': rss_start,
+            },
+            'summary': summarize(results),
+            'cases': results,
+            'failed': failed,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(json.dumps({k: v for k, v in report['summary'].items() if k != 'groups'}, indent=2))
+        print(f"Report written to {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        mismatch = corpus_mismatch(report, baseline)
+        if mismatch:
+            print(f"Warning: the baseline ran a different corpus ({', '.join(mismatch)} differ), "
+                  f"totals are not comparable", file=sys.stderr)
+        rows = compare(report, baseline, args.tolerance)
+        print_comparison(rows)
+        if any(row['regression'] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
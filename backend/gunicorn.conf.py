@@ -0,0 +1,38 @@
+# gunicorn settings for running the backend with several worker processes:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# Everything can be changed with the OCR_* environment variables below.
+
+import os
+
+from app.server import WORKERS, init_worker, worker_over_memory, shutdown_worker
+
+bind = os.environ.get('OCR_BIND', '0.0.0.0:5000')
+workers = WORKERS
+# Threads per worker: requests in one worker share its models and get batched together
+worker_class = 'gthread'
+threads = int(os.environ.get('OCR_WORKER_THREADS', '4'))
+
+# Load the app (and the models) once in the master, workers share them copy-on-write
+preload_app = True
+
+# Recycle workers after this many requests (plus some jitter so they don't all restart
+# together), which keeps slow memory growth in check. 0 turns it off.
+max_requests = int(os.environ.get('OCR_MAX_REQUESTS', '1000'))
+max_requests_jitter = max_requests // 10
+# Long PDFs take a while, and a recycled worker gets this long to finish what it's doing
+timeout = int(os.environ.get('OCR_WORKER_TIMEOUT', '300'))
+graceful_timeout = int(os.environ.get('OCR_GRACEFUL_TIMEOUT', '120'))
+
+
+def post_fork(server, worker):
+    init_worker(server.cfg.workers)
+
+
+def post_request(worker, req, environ, resp):
+    # Finish this request, then let the master replace the worker
+    if worker_over_memory():
+        worker.alive = False
+
+
+def worker_exit(server, worker):
+    shutdown_worker()
@@ -1,9 +1,17 @@
 # This is the starting point for running our web app!
 
+import os
+
 from app import create_app
 
-app = create_app()
+# With debug=True the reloader runs this file twice: in a watcher process that only restarts
+# the server when the code changes, and in the child that serves requests (WERKZEUG_RUN_MAIN
+# is set there). Only the serving process starts the job workers, otherwise the watcher would
+# take jobs from the same store and reset the ones the server is running.
+serving = __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+app = create_app(start_background=serving)
 
 if __name__ == '__main__':
     # Starts the app in "developer mode" for testing on my computer.
+    # For production use gunicorn instead: gunicorn -c gunicorn.conf.py wsgi:app
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
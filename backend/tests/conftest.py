@@ -0,0 +1,7 @@
+# Tests for the pure Python parts of the backend (no models needed). Run from backend/:
+#   python -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
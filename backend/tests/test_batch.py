@@ -0,0 +1,90 @@
+import io
+import threading
+import time
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from app import batch
+
+
+def fake_open_pages(content, mimetype, dpi=None):
+    # content is the list of page texts (or Exceptions to raise while rendering)
+    def pages():
+        for number, text in enumerate(content, start=1):
+            if isinstance(text, Exception):
+                raise text
+            yield number, text
+    return len(content), pages()
+
+
+def fake_ocr_source(number, source, page_count, lang='en', mode=None):
+    time.sleep(0.05)
+    if source == 'boom':
+        raise RuntimeError('engine broke')
+    return {'type': 'text', 'page': number, 'page_count': page_count, 'text': source,
+            'thread': threading.current_thread().name}
+
+
+def patch(monkeypatch):
+    monkeypatch.setattr(batch, 'open_pages', fake_open_pages)
+    monkeypatch.setattr(batch, 'ocr_source', fake_ocr_source)
+
+
+def test_pages_of_one_file_run_in_parallel(monkeypatch):
+    patch(monkeypatch)
+    pages = [f'page {n}' for n in range(8)]
+    start = time.perf_counter()
+    results = batch.process_batch([('long.pdf', 'application/pdf', pages)], {'details': True}, workers=4)
+    assert time.perf_counter() - start < 0.05 * 8 * 0.75
+    assert results[0]['result'] == '\n'.join(pages)
+    assert results[0]['page_count'] == 8
+    assert len({page['thread'] for page in results[0]['pages']}) > 1
+
+
+def test_results_keep_input_order_and_errors(monkeypatch):
+    patch(monkeypatch)
+    members = [
+        ('a.png', 'image/png', ['a']),
+        ('big.png', 'image/png', None),
+        ('broken.pdf', 'application/pdf', ['x', 'boom', 'y']),
+        ('unreadable.pdf', 'application/pdf', ['x', ValueError('bad page')]),
+        ('b.png', 'image/png', ['b']),
+    ]
+    results = batch.process_batch(members, {}, workers=3)
+    assert [entry['filename'] for entry in results] == ['a.png', 'big.png', 'broken.pdf', 'unreadable.pdf', 'b.png']
+    assert results[0]['result'] == 'a' and results[4]['result'] == 'b'
+    assert 'larger than' in results[1]['error']
+    assert results[2]['error'] == 'engine broke'
+    assert results[3]['error'] == 'bad page'
+    assert all('seconds' in entry for entry in results)
+
+
+def test_byte_budget_blocks_until_released():
+    budget = batch.ByteBudget(100)
+    budget.acquire(80)
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (budget.acquire(50), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.1)
+    budget.release(80)
+    assert acquired.wait(1)
+    thread.join()
+    # Nothing else in flight: an item bigger than the budget still gets through
+    budget.release(50)
+    budget.acquire(500)
+    assert budget.used == 500
+
+
+def test_source_bytes():
+    assert batch.source_bytes('text') == 4
+    assert batch.source_bytes(Image.new('RGB', (10, 20))) == 600
+
+
+def test_plain_files_over_the_upload_limit_are_not_read(monkeypatch):
+    monkeypatch.setattr(batch, 'MAX_UPLOAD_BYTES', 10)
+    files = [FileStorage(io.BytesIO(b'small'), 'a.png', content_type='image/png'),
+             FileStorage(io.BytesIO(b'x' * 11), 'b.png', content_type='image/png')]
+    members = list(batch.iter_upload_members(files))
+    assert [(name, content is None) for name, _, content in members] == [('a.png', False), ('b.png', True)]
+    assert members[0][2].read() == b'small'
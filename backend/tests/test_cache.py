@@ -0,0 +1,71 @@
+from app import cache
+from app.cache import LRUCache, ResultCache, TranslationMemory, normalize_segment
+
+
+def test_lru_forgets_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # 'a' is now the most recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_lru_of_size_zero_keeps_nothing():
+    cache = LRUCache(0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+
+
+def test_translation_memory_in_memory():
+    memory = TranslationMemory(max_entries=10, db_path='')
+    assert memory.lookup('en', 'fr', 'beam', ['Hello']) == [None]
+    memory.store('en', 'fr', 'beam', [('Hello', 'Bonjour')])
+    assert memory.lookup('en', 'fr', 'beam', ['Hello', 'Bye']) == ['Bonjour', None]
+    # Other language pairs and profiles are kept apart
+    assert memory.lookup('en', 'de', 'beam', ['Hello']) == [None]
+    assert memory.lookup('en', 'fr', 'greedy', ['Hello']) == [None]
+    stats = memory.stats()
+    assert stats['memory_hits'] == 1
+    assert stats['misses'] == 4
+
+
+def test_translation_memory_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'tm.db')
+    TranslationMemory(max_entries=10, db_path=path).store('en', 'fr', 'beam', [('Hello', 'Bonjour')])
+    memory = TranslationMemory(max_entries=10, db_path=path)
+    assert memory.lookup('en', 'fr', 'beam', ['Hello']) == ['Bonjour']
+    assert memory.stats()['db_hits'] == 1
+
+
+def test_translation_memory_opens_one_connection_per_process(tmp_path, monkeypatch):
+    memory = TranslationMemory(max_entries=0, db_path=str(tmp_path / 'tm.db'))
+    assert memory._connections == {}  # Nothing opened at import time, before gunicorn forks
+    memory.store('en', 'fr', 'beam', [('Hello', 'Bonjour')])
+    parent = memory._connection()
+    # A forked worker gets its own connection and still sees the stored rows
+    monkeypatch.setattr(cache.os, 'getpid', lambda: -1)
+    assert memory.lookup('en', 'fr', 'beam', ['Hello']) == ['Bonjour']
+    assert memory._connections[-1] is not parent
+
+
+def test_disabled_translation_memory():
+    memory = TranslationMemory(max_entries=0, db_path='')
+    memory.store('en', 'fr', 'beam', [('Hello', 'Bonjour')])
+    assert memory.lookup('en', 'fr', 'beam', ['Hello']) == [None]
+
+
+def test_normalize_segment():
+    assert normalize_segment('  Hello   world ') == normalize_segment('Hello world')
+
+
+def test_result_cache_counts_hits_and_misses():
+    cache = ResultCache(max_entries=4, directory='')
+    assert cache.get('page') is None
+    cache.put('page', {'text': 'hi'})
+    assert cache.get('page') == {'text': 'hi'}
+    stats = cache.stats()
+    assert (stats['memory_hits'], stats['misses'], stats['disk_dir']) == (1, 1, None)
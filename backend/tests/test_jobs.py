@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+from app import jobs
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = jobs.JobStore(str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(jobs, 'store', store)
+    monkeypatch.setattr(jobs, 'JOBS_DIR', str(tmp_path))
+    return store
+
+
+def test_create_and_get(store):
+    store.create('a', {'option': 'ocr', 'text': 'hi'})
+    job = store.get('a')
+    assert job['status'] == 'queued'
+    assert job['params'] == {'option': 'ocr', 'text': 'hi'}
+    assert store.get('missing') is None
+
+
+def test_only_one_claim_wins(store):
+    store.create('a', {})
+    assert store.claim('a')
+    assert not store.claim('a')
+    assert store.get('a')['status'] == 'running'
+    assert store.get('a')['started_at'] is not None
+
+
+def test_cancelled_job_cannot_be_claimed(store):
+    store.create('a', {})
+    jobs.cancel_job('a')
+    assert store.get('a')['status'] == 'cancelled'
+    assert not store.claim('a')
+
+
+def test_cancel_running_job_only_requests_it(store):
+    store.create('a', {})
+    store.claim('a')
+    job = jobs.cancel_job('a')
+    assert job['status'] == 'running'
+    assert job['cancel_requested'] == 1
+
+
+def test_requeue_running_jobs(store):
+    for job_id in ('a', 'b', 'c'):
+        store.create(job_id, {})
+    store.claim('a')
+    store.claim('b')
+    store.update('b', pages_done=3)
+
+    assert store.requeue(['b']) == 1
+    assert store.get('b')['status'] == 'queued'
+    assert store.get('b')['pages_done'] == 0
+    assert store.get('a')['status'] == 'running'
+
+    assert store.requeue() == 1
+    assert store.queued() == ['a', 'b', 'c']
+
+
+def test_run_job_with_text(store):
+    store.create('a', {'option': 'ocr', 'text': 'hello'})
+    jobs._run_job('a')
+    job = store.get('a')
+    assert job['status'] == 'done'
+    assert '"hello"' in job['result']
+    # A second run (e.g. the job was in two queues) does nothing
+    store.update('a', result='untouched')
+    jobs._run_job('a')
+    assert store.get('a')['result'] == 'untouched'
+
+
+def test_job_status_leaves_out_the_result(store):
+    store.create('a', {}, filename='scan.pdf')
+    status = jobs.job_status(store.get('a'))
+    assert status['job_id'] == 'a'
+    assert status['filename'] == 'scan.pdf'
+    assert 'result' not in status
+    assert not os.path.exists(os.path.join(jobs.JOBS_DIR, 'a.upload'))
+
+
+def _upload(job_id):
+    path = os.path.join(jobs.JOBS_DIR, f"{job_id}.upload")
+    with open(path, 'wb') as f:
+        f.write(b'data')
+    return path
+
+
+def test_cancelling_a_queued_job_removes_its_upload(store):
+    path = _upload('a')
+    store.create('a', {}, file_path=path)
+    jobs.cancel_job('a')
+    assert not os.path.exists(path)
+
+
+def test_cancelled_job_in_a_queue_cleans_up(store):
+    path = _upload('a')
+    store.create('a', {}, file_path=path)
+    store.update('a', status='cancelled')
+    jobs._run_job('a')
+    assert not os.path.exists(path)
+
+
+def test_job_claimed_elsewhere_keeps_its_upload(store):
+    path = _upload('a')
+    store.create('a', {}, file_path=path)
+    store.claim('a')
+    jobs._run_job('a')
+    assert os.path.exists(path)
+
+
+def test_purge_expired_jobs(store):
+    path = _upload('old')
+    store.create('old', {}, file_path=path)
+    store.update('old', status='done', finished_at=1.0)
+    store.create('new', {})
+    store.update('new', status='done', finished_at=time.time())
+    store.create('queued', {})
+
+    assert jobs.purge_expired_jobs(retention_hours=1) == 1
+    assert store.get('old') is None
+    assert not os.path.exists(path)
+    assert store.get('new') is not None
+    assert store.get('queued') is not None
+    assert jobs.purge_expired_jobs(retention_hours=0) == 0
+
+
+def test_stale_running_jobs_start_over(store):
+    path = _upload('cancelled')
+    for job_id in ('alive', 'dead', 'cancelled'):
+        store.create(job_id, {}, file_path=path if job_id == 'cancelled' else None)
+        store.claim(job_id)
+    store.update('dead', heartbeat_at=1.0, pages_done=5)
+    store.update('cancelled', heartbeat_at=1.0, cancel_requested=1)
+    store.beat(['alive'])
+
+    assert jobs.requeue_stale_jobs(stale_seconds=60) == ['dead']
+    assert store.get('dead')['status'] == 'queued'
+    assert store.get('dead')['pages_done'] == 0
+    assert store.get('alive')['status'] == 'running'
+    assert store.get('cancelled')['status'] == 'cancelled'
+    assert not os.path.exists(path)
+    assert jobs.requeue_stale_jobs(stale_seconds=0) == []
+
+
+def test_old_database_gets_the_heartbeat_column(tmp_path):
+    path = str(tmp_path / 'old.db')
+    with sqlite3.connect(path) as db:
+        db.execute('CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT, params TEXT, filename TEXT, mimetype TEXT, '
+                   'file_path TEXT, page_count INTEGER, pages_done INTEGER DEFAULT 0, '
+                   'cancel_requested INTEGER DEFAULT 0, result TEXT, error TEXT, '
+                   'created_at REAL, started_at REAL, finished_at REAL)')
+    store = jobs.JobStore(path)
+    store.create('a', {})
+    assert store.claim('a')
+    assert store.get('a')['heartbeat_at'] is not None
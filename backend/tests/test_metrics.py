@@ -0,0 +1,68 @@
+from app.metrics import Metrics, Trace, tracing, stage, record, _current_trace
+
+
+def test_counter_and_histogram_render():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.describe('requests_total', 'counter', 'Requests.')
+    metrics.describe('latency_seconds', 'histogram', 'Latency.')
+    metrics.inc('requests_total', route='/process', status='200')
+    metrics.inc('requests_total', route='/process', status='200')
+    metrics.observe('latency_seconds', 0.05, stage='decode')
+    metrics.observe('latency_seconds', 0.5, stage='decode')
+
+    text = metrics.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{route="/process",status="200"} 2' in text
+    assert 'latency_seconds_bucket{stage="decode",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="decode",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{stage="decode",le="+Inf"} 2' in text
+    assert 'latency_seconds_count{stage="decode"} 2' in text
+    assert 'latency_seconds_sum{stage="decode"} 0.55' in text
+    assert text.endswith('\n')
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.inc('odd_total', title='say "hi"\n')
+    assert 'odd_total{title="say \\"hi\\"\\n"} 1' in metrics.render()
+
+
+def test_collectors_and_broken_collectors():
+    metrics = Metrics()
+
+    def good():
+        yield 'queue_depth', 'gauge', 'Items waiting.', {'model': 'trocr'}, 3
+        yield 'load_seconds', 'gauge', 'Not loaded yet.', {}, None
+
+    def broken():
+        raise RuntimeError('nope')
+
+    metrics.add_collector(good)
+    metrics.add_collector(broken)
+    text = metrics.render()
+    assert '# TYPE queue_depth gauge' in text
+    assert 'queue_depth{model="trocr"} 3' in text
+    assert 'load_seconds' not in text
+
+
+def test_trace_collects_stages():
+    assert _current_trace.get() is None
+    with tracing() as trace:
+        with stage('decode'):
+            pass
+        record('engine', 0.25, engine='tesseract')
+    assert _current_trace.get() is None
+
+    spans = trace.to_dict()['spans']
+    # Spans are sorted by start, and record() without a start counts back from now
+    assert [span['stage'] for span in spans] == ['engine', 'decode']
+    assert spans[0]['engine'] == 'tesseract'
+    assert spans[0]['ms'] == 250.0
+
+
+def test_tracing_disabled():
+    with tracing(False) as trace:
+        with stage('decode'):
+            pass
+    assert trace is None
+    assert isinstance(Trace().to_dict()['spans'], list)
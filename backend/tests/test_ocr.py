@@ -0,0 +1,59 @@
+import random
+
+from PIL import Image
+
+from app import ocr
+from benchmarks.corpus import SANS_FONTS, find_font, render_receipt
+
+
+def test_regions_are_not_searched_when_turned_off(monkeypatch):
+    def find_regions(page):
+        raise AssertionError('regions computed with OCR_TEXT_REGIONS=0')
+
+    monkeypatch.setattr(ocr, 'TEXT_REGIONS', False)
+    monkeypatch.setitem(ocr.PREPROCESSORS, 'regions', find_regions)
+    page = ocr.PreparedPage(Image.new('RGB', (200, 100), 'white'))
+    assert page.regions() == [page]
+
+
+def test_settings_key_changes_with_code_threshold(monkeypatch):
+    key = ocr.ocr_settings_key('en', 'all')
+    monkeypatch.setattr(ocr, 'CODE_THRESHOLD', ocr.CODE_THRESHOLD + 0.1)
+    assert ocr.ocr_settings_key('en', 'all') != key
+
+
+def test_cascade_tier_one_counts_as_an_engine_call(monkeypatch):
+    def tesseract(image, lang='en'):
+        return {'text': 'hello', 'confidence': 95.0, 'coverage': 1.0, 'words': 1, 'word_boxes': []}
+
+    monkeypatch.setattr(ocr, 'ocr_with_tesseract_data', tesseract)
+    monkeypatch.setattr(ocr, 'TEXT_REGIONS', False)
+    key = ('ocr_engine_calls_total', (('engine', 'tesseract'), ('outcome', 'text')))
+    before = ocr.metrics._counters.get(key, 0)
+    page = ocr.ocr_non_code_page(ocr.PreparedPage(Image.new('RGB', (200, 100), 'white')), 'en', 'cascade')
+    assert page['tier'] == 1
+    assert ocr.metrics._counters.get(key, 0) == before + 1
+
+
+def test_receipt_items_stay_on_the_line_of_their_price():
+    font_size = 22
+    image, text = render_receipt(random.Random(0), font_size=font_size)
+    font = find_font(SANS_FONTS, font_size)
+    regions = ocr.PreparedPage(image).variant('regions')
+    assert regions
+
+    def region_at(x, y):
+        return [box for box in regions if box[0] <= x <= box[2] and box[1] <= y <= box[3]]
+
+    # Item lines come after the shop name, its address and a blank line (see render_receipt)
+    for number, line in enumerate(text.split('\n')[3:7], start=3):
+        middle = 60 + number * font_size * 1.6 + font_size / 2
+        item = region_at(65, middle)
+        price = region_at(60 + font.getlength(line) - 5, middle)
+        assert item and item == price, line
+
+
+def test_pages_without_text_still_get_the_side_cap():
+    assert ocr.text_scale(None, 20, (9000, 9000)) == round(ocr.MAX_PREPROCESS_SIDE / 9000, 3)
+    assert ocr.text_scale(None, 20, (1000, 800)) == 1.0
+    assert ocr.text_scale(10, 20, (9000, 9000)) == round(ocr.MAX_PREPROCESS_SIDE / 9000, 3)
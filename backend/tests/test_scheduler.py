@@ -0,0 +1,121 @@
+import threading
+import time
+
+from app import executor
+from app.scheduler import BatchScheduler
+
+
+def test_results_come_back_in_order():
+    scheduler = BatchScheduler('test-order', lambda key, items: [item * 2 for item in items], max_batch=4)
+    assert scheduler.run([1, 2, 3, 4, 5]) == [2, 4, 6, 8, 10]
+
+
+def test_concurrent_callers_share_a_batch():
+    batches = []
+
+    def run_batch(key, items):
+        batches.append(list(items))
+        return items
+
+    scheduler = BatchScheduler('test-share', run_batch, max_batch=8, window_ms=200)
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.update({i: scheduler.run([i])})) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {i: [i] for i in range(4)}
+    assert max(len(batch) for batch in batches) > 1
+    assert scheduler.stats()['items'] == 4
+
+
+def test_batches_never_mix_keys():
+    seen = []
+
+    def run_batch(key, items):
+        seen.append((key, list(items)))
+        return [f"{key}:{item}" for item in items]
+
+    scheduler = BatchScheduler('test-keys', run_batch, max_batch=8, window_ms=100)
+    futures = [scheduler.submit(i, key='a' if i % 2 else 'b') for i in range(6)]
+    assert [future.result(timeout=5) for future in futures] == [f"{'a' if i % 2 else 'b'}:{i}" for i in range(6)]
+    for key, items in seen:
+        assert all(('a' if item % 2 else 'b') == key for item in items)
+
+
+def test_max_batch_is_respected():
+    sizes = []
+
+    def run_batch(key, items):
+        sizes.append(len(items))
+        return items
+
+    scheduler = BatchScheduler('test-max', run_batch, max_batch=3, window_ms=50)
+    assert scheduler.run(list(range(10))) == list(range(10))
+    assert max(sizes) <= 3
+
+
+def test_cancelled_items_are_skipped():
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def run_batch(key, items):
+        if key == 'block':
+            started.set()
+            release.wait(5)
+        ran.extend(items)
+        return items
+
+    scheduler = BatchScheduler('test-cancel', run_batch, max_batch=1, window_ms=0)
+    blocker = scheduler.submit('blocker', key='block')
+    assert started.wait(5)
+    # Queued behind the blocker, then cancelled before the worker gets to it
+    cancelled = scheduler.submit('cancelled')
+    assert cancelled.cancel()
+    kept = scheduler.submit('kept')
+    release.set()
+
+    assert blocker.result(timeout=5) == 'blocker'
+    assert kept.result(timeout=5) == 'kept'
+    assert 'cancelled' not in ran
+
+
+def test_failing_batch_fails_every_caller():
+    def run_batch(key, items):
+        raise RuntimeError('model broke')
+
+    scheduler = BatchScheduler('test-fail', run_batch, max_batch=4, window_ms=50)
+    futures = [scheduler.submit(i) for i in range(3)]
+    for future in futures:
+        try:
+            future.result(timeout=5)
+            assert False, 'expected an error'
+        except RuntimeError as e:
+            assert str(e) == 'model broke'
+
+    # The worker keeps going after a failed batch
+    scheduler.run_batch = lambda key, items: items
+    time.sleep(0.05)
+    assert scheduler.run([7]) == [7]
+
+
+def test_batches_wait_for_their_torch_turn():
+    scheduler = BatchScheduler('test-turn', lambda key, items: items)
+    with executor.torch_turn:
+        future = scheduler.submit(1)
+        time.sleep(0.1)
+        assert not future.done()
+    assert future.result(timeout=1) == 1
+
+
+def test_cpu_budget_is_split_between_tesseract_and_torch(monkeypatch):
+    monkeypatch.setattr(executor, 'TORCH_THREADS', 0)
+    monkeypatch.setattr(executor, 'MAX_CPU_THREADS', 8)
+    monkeypatch.setattr(executor, 'SUBPROCESS_WORKERS', 2)
+    assert executor.torch_threads() == 6
+    monkeypatch.setattr(executor, 'TORCH_THREADS', 4)
+    assert executor.torch_threads() == 4
+    monkeypatch.setattr(executor, 'TORCH_THREADS', 16)
+    assert executor.torch_threads() == 6
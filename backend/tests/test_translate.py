@@ -0,0 +1,22 @@
+from app.translate import split_segments
+
+
+class WordTokenizer:
+    """One token per word, enough to test the splitting."""
+
+    def tokenize(self, text):
+        return text.split()
+
+
+def test_lines_and_sentences_are_kept_apart():
+    lines = split_segments('One two. Three four!\nFive six', WordTokenizer(), max_tokens=10)
+    assert lines == [['One two.', 'Three four!'], ['Five six']]
+
+
+def test_long_sentences_are_cut_into_chunks():
+    lines = split_segments('a b c d e f g', WordTokenizer(), max_tokens=3)
+    assert lines == [['a b c', 'd e f', 'g']]
+
+
+def test_empty_lines_stay_empty():
+    assert split_segments('Hello.\n\nBye.', WordTokenizer()) == [['Hello.'], [], ['Bye.']]
@@ -0,0 +1,11 @@
+# Production entry point, run it with gunicorn (settings are in gunicorn.conf.py):
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# With preload_app the master imports this file once, loads the models and then forks
+# the workers, which share the loaded models (see app/server.py).
+
+from app import create_app
+from app.server import prepare_master
+
+# Background threads are started in every worker after the fork, not here
+app = create_app(start_background=False)
+prepare_master()